@@ -0,0 +1,290 @@
+##-----------------------------------------------------------------------------
+##
+## benchmarks of validation and scoring on synthetic challenge files
+##
+##   python benchmark.py --sizes 100,10000,1000000 --out results.json
+##   python benchmark.py --baseline results.json
+##
+##-----------------------------------------------------------------------------
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+import challenge_config as conf
+import gold_store
+
+BOM = '\xef\xbb\xbf'
+
+## challenge key -> whether its gold standard holds 0/1 labels
+KEYS = [('challenge1', True), ('challenge2', True), ('challenge3', False)]
+
+## getAUROC_PR loops over the blocks of tied scores, so it is quadratic in
+## the number of subjects (about 30s at 2000) and only run up to this size
+## by default
+LEGACY_MAX_SUBJECTS = 2000
+
+## a run regresses when it is this many times slower, or uses this many
+## times the memory, of the same run in the baseline
+DEFAULT_TOLERANCE = 1.5
+
+
+##-----------------------------------------------------------------------------
+## synthetic files
+##-----------------------------------------------------------------------------
+
+def subject_ids(n):
+    return np.array(['SUBJ%08d' % i for i in xrange(n)], dtype=object)
+
+
+def make_truth(rng, n, binary, positive_rate):
+    """
+    Gold standard values: 0/1 labels with the given rate of positives, or
+    normal scores like LOGSYMPTSCORE_SC3
+    """
+    if binary:
+        return (rng.rand(n) < positive_rate).astype('float64')
+    return rng.normal(size=n)
+
+
+def make_predictions(rng, truth, ties):
+    """
+    Belief scores that carry some signal about truth. ties is the fraction
+    of subjects that share a score with another one: the scores take
+    n * (1 - ties) distinct values.
+    """
+    n = len(truth)
+    scores = truth + rng.normal(scale=2.0, size=n)
+    levels = max(1, int(round(n * (1 - ties))))
+    ranks = scores.argsort().argsort()
+    return (ranks * levels // n) / float(levels)
+
+
+def write_csv(path, ids, column, values, bom=False):
+    """Writes a SUBJECTID,column file, with a byte order mark if asked to"""
+    with open(path, 'wb') as f:
+        f.write((BOM if bom else '') + 'SUBJECTID,%s\n' % column)
+        pd.DataFrame({'SUBJECTID': ids, column: values})[['SUBJECTID', column]].to_csv(f, header=False, index=False)
+
+
+def make_case(directory, key, binary, n, ties, positive_rate, bom, seed):
+    """
+    Writes a gold standard and a submission in shuffled order for key
+
+    :returns: (goldstandard path, submission path)
+    """
+    rng = np.random.RandomState(seed)
+    column = conf.challenge[key]
+    ids = subject_ids(n)
+    truth = make_truth(rng, n, binary, positive_rate)
+    predict = make_predictions(rng, truth, ties)
+
+    goldstandard = os.path.join(directory, 'gold_%s_%d.csv' % (key, n))
+    submission = os.path.join(directory, 'submission_%s_%d.csv' % (key, n))
+    write_csv(goldstandard, ids, column, truth)
+    shuffle = rng.permutation(n)
+    write_csv(submission, ids[shuffle], column, predict[shuffle], bom=bom)
+    return goldstandard, submission
+
+
+##-----------------------------------------------------------------------------
+## measurements
+##-----------------------------------------------------------------------------
+
+def _measure(func, args, setup, repeat, pipe):
+    """
+    Runs in a child process so that peak RSS belongs to this run alone.
+    The gold standard is parsed before timing, as preload_goldstandards
+    does before a validate or score run.
+    """
+    try:
+        gold_store.get(args[1])
+        if setup is not None:
+            func, args = setup(*args)
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        seconds = []
+        for _ in xrange(repeat):
+            start = time.time()
+            func(*args)
+            seconds.append(time.time() - start)
+        pipe.send(dict(seconds=min(seconds),
+                       peak_rss_kb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                       start_rss_kb=rss_before))
+    except Exception as ex:
+        pipe.send(dict(error='%s: %s' % (type(ex).__name__, ex)))
+    finally:
+        pipe.close()
+
+
+def _setup_legacy(submission, goldstandard, key):
+    """
+    getAUROC_PR is benchmarked on its own, on already aligned arrays sorted
+    by descending belief score as score_1_2 hands them over
+    """
+    predict, truth = conf.align_submission(submission, gold_store.get(goldstandard), key)
+    df = pd.DataFrame.from_dict({'predict': predict, 'truth': truth}, dtype='float64')
+    df = df.sort_values(['predict'], ascending=False)
+    return conf.getAUROC_PR, (df,)
+
+
+def measure(func, args, repeat, setup=None):
+    """
+    Times func(*args) in a child process. setup(*args), when given, runs
+    untimed first and returns the (func, args) to time instead.
+
+    :returns: dict of seconds (best of repeat), peak_rss_kb and
+              start_rss_kb, or of error if func raised
+    """
+    parent, child = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=_measure, args=(func, args, setup, repeat, child))
+    process.start()
+    child.close()
+    try:
+        result = parent.recv()
+    except EOFError:
+        result = dict(error='benchmark process died with exit code %s' % process.exitcode)
+    process.join()
+    return result
+
+
+def cases(key, binary, n, args):
+    """(name, function, setup) of each benchmarked function for key"""
+    yield 'validate', conf.validate, None
+    yield 'validate_streaming', conf.validate_streaming, None
+    if binary:
+        yield 'score_1_2', conf.score_1_2, None
+        if n <= args.legacy_max_subjects:
+            yield 'getAUROC_PR', None, _setup_legacy
+    else:
+        yield 'score_3', conf.score_3, None
+
+
+def run(args):
+    """
+    Benchmarks every function over every size
+
+    :returns: list of result dicts
+    """
+    if args.permute_times is not None:
+        conf.PERMUTE_TIMES = args.permute_times
+    if args.bootstrap_times is not None:
+        conf.BOOTSTRAP_TIMES = args.bootstrap_times
+
+    results = []
+    directory = tempfile.mkdtemp(prefix='challenge_benchmark_')
+    try:
+        for n in args.sizes:
+            for key, binary in KEYS:
+                goldstandard, submission = make_case(
+                    directory, key, binary, n, args.ties, args.positive_rate, args.bom, args.seed)
+                for name, func, setup in cases(key, binary, n, args):
+                    result = dict(function=name, key=key, subjects=n, ties=args.ties,
+                                  positive_rate=args.positive_rate if binary else None, bom=args.bom)
+                    result.update(measure(func, (submission, goldstandard, key), args.repeat, setup))
+                    if 'seconds' in result:
+                        result['subjects_per_second'] = n / result['seconds'] if result['seconds'] > 0 else None
+                    results.append(result)
+                    print_result(result)
+                os.remove(goldstandard)
+                os.remove(submission)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def print_result(result):
+    if 'error' in result:
+        print "%-20s %-11s %9d  ERROR %s" % (result['function'], result['key'], result['subjects'], result['error'])
+    else:
+        print "%-20s %-11s %9d %10.4fs %10d KB %14.0f subjects/s" % (
+            result['function'], result['key'], result['subjects'],
+            result['seconds'], result['peak_rss_kb'], result['subjects_per_second'] or 0)
+    sys.stdout.flush()
+
+
+##-----------------------------------------------------------------------------
+## baselines
+##-----------------------------------------------------------------------------
+
+def _case_id(result):
+    return (result['function'], result['key'], result['subjects'], result['ties'],
+            result['positive_rate'], result['bom'])
+
+
+def regressions(results, baseline, tolerance):
+    """
+    Compares results with the runs of the same case in baseline
+
+    :returns: list of messages, one per run that got slower or bigger than
+              tolerance times its baseline, or that now fails
+    """
+    previous = {_case_id(result): result for result in baseline['results']}
+    problems = []
+    for result in results:
+        old = previous.get(_case_id(result))
+        if old is None or 'error' in old:
+            continue
+        label = '%s %s %d subjects' % (result['function'], result['key'], result['subjects'])
+        if 'error' in result:
+            problems.append('%s failed: %s' % (label, result['error']))
+            continue
+        if result['seconds'] > old['seconds'] * tolerance:
+            problems.append('%s took %.4fs, baseline %.4fs' % (label, result['seconds'], old['seconds']))
+        if result['peak_rss_kb'] > old['peak_rss_kb'] * tolerance:
+            problems.append('%s peaked at %d KB, baseline %d KB' % (label, result['peak_rss_kb'], old['peak_rss_kb']))
+    return problems
+
+
+def environment():
+    return dict(python=platform.python_version(), platform=platform.platform(),
+                numpy=np.__version__, pandas=pd.__version__,
+                cpus=multiprocessing.cpu_count(), auc_engine=conf.AUC_ENGINE,
+                permute_times=conf.PERMUTE_TIMES, bootstrap_times=conf.BOOTSTRAP_TIMES)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark validation and scoring on synthetic challenge files")
+    parser.add_argument("--sizes", help="Comma separated numbers of subjects", default="100,1000,10000,100000")
+    parser.add_argument("--ties", help="Fraction of subjects sharing a belief score with another one", type=float, default=0.5)
+    parser.add_argument("--positive-rate", help="Fraction of positives in the SC1/SC2 gold standards", type=float, default=0.3)
+    parser.add_argument("--bom", help="Write submissions with a byte order mark", action="store_true", default=False)
+    parser.add_argument("--repeat", help="Runs of each case, the fastest is reported", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=2016)
+    parser.add_argument("--permute-times", help="Override challenge_config.PERMUTE_TIMES", type=int, default=None)
+    parser.add_argument("--bootstrap-times", help="Override challenge_config.BOOTSTRAP_TIMES", type=int, default=None)
+    parser.add_argument("--legacy-max-subjects", help="Largest size getAUROC_PR is run on", type=int, default=LEGACY_MAX_SUBJECTS)
+    parser.add_argument("--out", help="Write results as JSON to this file", default=None)
+    parser.add_argument("--baseline", help="JSON results of an earlier run to check for regressions", default=None)
+    parser.add_argument("--tolerance", help="Allowed slowdown or memory growth over the baseline", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args()
+    args.sizes = [int(float(size)) for size in args.sizes.split(',')]
+
+    results = run(args)
+    report = dict(environment=environment(), results=results)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        problems = regressions(results, baseline, args.tolerance)
+        if problems:
+            print "\nRegressions against %s:" % args.baseline
+            for problem in problems:
+                print "  " + problem
+            return 1
+        print "\nNo regressions against %s" % args.baseline
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,144 @@
+##-----------------------------------------------------------------------------
+##
+## bootstrap confidence intervals of submission scores
+##
+##-----------------------------------------------------------------------------
+import multiprocessing
+import time
+import numpy as np
+import permutation
+import scoring
+
+
+def resample_counts(rng, batch, n):
+    """
+    How many times each of n subjects is drawn, for batch resamples of n
+    subjects with replacement
+    """
+    return rng.multinomial(n, np.ones(n) / n, size=batch)
+
+
+def resampled_positions(counts):
+    """
+    The resampled positions of each row of counts, in increasing order. When
+    the positions index an array sorted by belief score, the resamples come
+    out sorted too, so no replicate is sorted again.
+    """
+    batch, n = counts.shape
+    return np.repeat(np.tile(np.arange(n), batch), counts.ravel()).reshape(batch, n)
+
+
+def _auc_batch(task):
+    (predict, truePos), batch, seed = task
+    positions = resampled_positions(resample_counts(np.random.RandomState(seed), batch, len(predict)))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        auroc, aupr = scoring.curve_auc(*scoring.rowwise_curves(predict[positions], truePos[positions]))
+    return np.column_stack([auroc, aupr])
+
+
+def _correlation_batch(task):
+    """
+    Pearson correlations of a batch of resamples, weighting each subject by
+    how many times it was drawn
+    """
+    (submitted, gold), batch, seed = task
+    n = len(submitted)
+    weights = resample_counts(np.random.RandomState(seed), batch, n).astype('float64')
+    mean_submitted = weights.dot(submitted) / n
+    mean_gold = weights.dot(gold) / n
+    cov = weights.dot(submitted * gold) / n - mean_submitted * mean_gold
+    var_submitted = weights.dot(submitted ** 2) / n - mean_submitted ** 2
+    var_gold = weights.dot(gold ** 2) / n - mean_gold ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (cov / np.sqrt(var_submitted * var_gold))[:, None]
+
+
+def run_replicates(worker, payload, times, n, seed=None, processes=None, batch_size=250, time_budget=None):
+    """
+    Runs worker((payload, batch, seed)) over seeded batches of resamples,
+    in a process pool unless processes is 1, until every batch is done or
+    time_budget seconds have passed.
+
+    :returns: array with one row per replicate that finished in time
+    """
+    tasks = [(payload, batch, batch_seed) for batch, batch_seed in permutation.seeded_batches(times, n, batch_size, seed)]
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = max(1, min(processes, len(tasks)))
+    deadline = time.time() + time_budget if time_budget else None
+
+    results = []
+    if processes == 1:
+        for task in tasks:
+            if deadline and time.time() > deadline:
+                break
+            results.append(worker(task))
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            batches = pool.imap(worker, tasks)
+            for _ in tasks:
+                remaining = deadline - time.time() if deadline else None
+                if remaining is not None and remaining <= 0:
+                    break
+                try:
+                    results.append(batches.next(timeout=remaining))
+                except multiprocessing.TimeoutError:
+                    break
+        finally:
+            pool.terminate()
+            pool.join()
+    if not results:
+        return None
+    return np.concatenate(results)
+
+
+def intervals(replicates, confidence, columns):
+    """
+    Percentile interval of each column of replicates
+
+    :returns: list of (low, high), NaN when no replicate finished
+    """
+    tail = 100 * (1 - confidence) / 2.0
+    if replicates is None:
+        return [(np.nan, np.nan)] * columns
+    low = np.nanpercentile(replicates, tail, axis=0)
+    high = np.nanpercentile(replicates, 100 - tail, axis=0)
+    return zip(low, high)
+
+
+def auc_intervals(predict, truth, times=1000, confidence=0.95, seed=None, processes=None, time_budget=None):
+    """
+    Bootstrap confidence intervals of the AUROC and AUPR of a submission
+
+    :param predict: array of submitted belief scores
+    :param truth: array of gold standard labels (1 is a true positive)
+    :param times: number of resamples
+    :param time_budget: seconds after which the interval is computed from
+                        the resamples finished so far
+
+    :returns: ((AUROC_low, AUROC_high), (AUPR_low, AUPR_high))
+    """
+    order = scoring.tie_blocks(predict)[0]
+    predict = np.asarray(predict, dtype='float64')[order]
+    truePos = (np.asarray(truth, dtype='float64')[order] == 1).astype('float64')
+    replicates = run_replicates(_auc_batch, (predict, truePos), times, len(predict),
+                                seed=seed, processes=processes, time_budget=time_budget)
+    roc, pr = intervals(replicates, confidence, 2)
+    return(roc, pr)
+
+
+def correlation_interval(submitted, gold, times=1000, confidence=0.95, seed=None, processes=1, time_budget=None):
+    """
+    Bootstrap confidence interval of the Pearson correlation of a submission
+
+    :returns: (low, high)
+    """
+    submitted = np.asarray(submitted, dtype='float64')
+    gold = np.asarray(gold, dtype='float64')
+    #centering first keeps the weighted moments accurate
+    submitted = submitted - submitted.mean()
+    gold = gold - gold.mean()
+    replicates = run_replicates(_correlation_batch, (submitted, gold), times, len(gold),
+                                seed=seed, processes=processes, time_budget=time_budget)
+    return intervals(replicates, confidence, 1)[0]
@@ -32,17 +32,22 @@ from datetime import datetime, timedelta
 from itertools import izip
 from StringIO import StringIO
 import copy
+import functools
 
 import argparse
 import lock
+import lookup_cache
 import json
 import math
 import os
 import random
 import re
+import requests
+import signal
 import sys
 import tarfile
 import tempfile
+import threading
 import time
 import traceback
 import urllib
@@ -55,12 +60,47 @@ except Exception as ex1:
     sys.stderr.write("\nPlease configure your challenge. See challenge_config.template.py for an example.\n\n")
     raise ex1
 
+import leaderboard_mirror
+import leaderboard_sync
 import messages
+import prefetch
+import rank_index
+import ranking
+import sandbox
+import state_index
+import status_buffer
+import submission_cache
+import worker_pool
 
 
 # the batch size can be bigger, we do this just to demonstrate batching
 BATCH_SIZE = 20
 
+# bounds in seconds of the adaptive wait between rounds of the daemon
+DAEMON_MIN_INTERVAL = 5
+DAEMON_MAX_INTERVAL = 300
+
+# how many submission files are downloaded ahead of validation and scoring
+PREFETCH_DEPTH = 4
+
+# longest time in seconds a status update waits in a status buffer
+STATUS_FLUSH_SECONDS = 60
+
+# a stage lock whose holder stopped refreshing it for this long is broken
+STAGE_LOCK_MAX_AGE = timedelta(minutes=10)
+
+# seconds between refreshes of a held stage lock
+STAGE_LOCK_HEARTBEAT = 30
+
+# largest page of submission query results to ask for
+QUERY_MAX_LIMIT = 500
+
+# retries of a submission query page after a transient error, the first
+# after QUERY_RETRY_DELAY seconds and each next one after twice as long
+QUERY_RETRIES = 4
+QUERY_RETRY_DELAY = 1
+TRANSIENT_STATUS_CODES = (429, 500, 502, 503, 504)
+
 # how many times to we retry batch uploads of submission annotations
 BATCH_UPLOAD_RETRY_COUNT = 5
 
@@ -69,6 +109,25 @@ UUID_REGEX = re.compile('[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f
 # A module level variable to hold the Synapse connection
 syn = None
 
+# seconds to wait for a stage lock held by another run, see stage_locked
+lock_timeout = 0
+
+# validate and score each submission in a child process with the limits in
+# challenge_config, see process_submissions
+sandboxed = False
+
+# cached user profiles and teams, see lookup_cache.py
+lookups = None
+
+# local index of submission states, see state_index.py
+states = None
+
+# local copy of the leaderboards, see leaderboard_mirror.py
+mirror = None
+
+# how many IDs to look up per bulk profile or team request
+LOOKUP_BATCH_SIZE = 100
+
 
 def to_column_objects(leaderboard_columns):
     """
@@ -89,6 +148,83 @@ def get_user_name(profile):
         names.append(profile['userName'])
     return " ".join(names)
 
+def _lookups():
+    global lookups
+    if lookups is None:
+        lookups = lookup_cache.LookupCache()
+    return lookups
+
+def _states():
+    global states
+    if states is None:
+        states = state_index.StateIndex()
+    return states
+
+def _mirror():
+    global mirror
+    if mirror is None:
+        mirror = leaderboard_mirror.LeaderboardMirror()
+    return mirror
+
+def leaderboard_columns_of(evaluation_id):
+    """The leaderboard columns of an evaluation, the default ones if it has none"""
+    return conf.leaderboard_columns.get(int(evaluation_id), conf.LEADERBOARD_COLUMNS)
+
+def file_md5(submission):
+    """MD5 of a downloaded submission file, or None"""
+    try:
+        return submission_cache.file_md5(submission.filePath)
+    except (AttributeError, IOError, OSError):
+        return None
+
+def indexed(submission, md5, notify, dry_run=False):
+    """
+    on_stored callback for a status buffer that records the stored status
+    in the state index and then calls notify(status). A dry run only
+    notifies, as nothing was stored.
+    """
+    def on_stored(status):
+        if not dry_run:
+            _states().record(submission, status, md5=md5, processed=True)
+        notify(status)
+    return on_stored
+
+def get_profile(userId):
+    """
+    The cached profile of a user, see lookup_cache.profile_fields
+    """
+    return _lookups().get('profile', userId, lambda id: lookup_cache.profile_fields(syn.getUserProfile(id)))
+
+def get_team(teamId):
+    """
+    The cached team, with its id and name
+    """
+    def fetch(id):
+        team = syn.restGET('/team/{id}'.format(id=id))
+        return {key: team[key] for key in ('id', 'name') if key in team}
+    return _lookups().get('team', teamId, fetch)
+
+def preload_lookups():
+    """
+    Refreshes the expired profiles and teams in the lookup cache with bulk
+    requests, so the validate and score loops mostly find them cached
+    """
+    cache = _lookups()
+    user_ids = cache.stale('profile')
+    team_ids = cache.stale('team')
+    try:
+        for offset in range(0, len(user_ids), LOOKUP_BATCH_SIZE):
+            ids = ','.join(user_ids[offset:offset+LOOKUP_BATCH_SIZE])
+            for header in syn.restGET('/userGroupHeaders/batch?ids=%s' % ids)['children']:
+                cache.put('profile', header['ownerId'], lookup_cache.profile_fields(header))
+        for offset in range(0, len(team_ids), LOOKUP_BATCH_SIZE):
+            ids = [int(id) for id in team_ids[offset:offset+LOOKUP_BATCH_SIZE]]
+            for team in syn.restPOST('/teamList', json.dumps({'list': ids}))['list']:
+                cache.put('team', team['id'], {'id': team['id'], 'name': team['name']})
+    except SynapseHTTPError as ex1:
+        ## not fatal, whatever is still expired gets looked up one by one
+        sys.stderr.write('Bulk refresh of cached profiles and teams failed: %s\n' % ex1)
+
 def update_single_submission_status(status, add_annotations):
     for keys in add_annotations:
         if status.get("annotations") is not None:
@@ -105,32 +241,24 @@ def update_single_submission_status(status, add_annotations):
             status.annotations = add_annotations
     return(status)
 
+def status_buffer_for(evaluation, dry_run=False):
+    """
+    A write-behind buffer of status updates for an evaluation, see
+    status_buffer.StatusBuffer
+    """
+    return status_buffer.StatusBuffer(syn, utils.id_of(evaluation),
+        batch_size=BATCH_SIZE, flush_seconds=STATUS_FLUSH_SECONDS,
+        retries=BATCH_UPLOAD_RETRY_COUNT, dry_run=dry_run)
+
 def update_submissions_status_batch(evaluation, statuses):
     """
     Update statuses in batch. This can be much faster than individual updates,
     especially in rank based scoring methods which recalculate scores for all
     submissions each time a new submission is received.
     """
-
-    for retry in range(BATCH_UPLOAD_RETRY_COUNT):
-        try:
-            token = None
-            offset = 0
-            while offset < len(statuses):
-                batch = {"statuses"     : statuses[offset:offset+BATCH_SIZE],
-                         "isFirstBatch" : (offset==0),
-                         "isLastBatch"  : (offset+BATCH_SIZE>=len(statuses)),
-                         "batchToken"   : token}
-                response = syn.restPUT("/evaluation/%s/statusBatch" % evaluation.id, json.dumps(batch))
-                token = response.get('nextUploadToken', None)
-                offset += BATCH_SIZE
-        except SynapseHTTPError as err:
-            # on 412 ConflictingUpdateException we want to retry
-            if err.response.status_code == 412:
-                # sys.stderr.write('%s, retrying...\n' % err.message)
-                time.sleep(2)
-            else:
-                raise
+    with status_buffer_for(evaluation) as buffer:
+        for status in statuses:
+            buffer.add(status)
 
 
 class Query(object):
@@ -138,36 +266,206 @@ class Query(object):
     An object that helps with paging through annotation query results.
 
     Also exposes properties totalNumberOfResults, headers and rows.
+
+    Pages start at limit rows and double up to max_limit, or to the page
+    size the server caps them at, with the next page fetched in a
+    background thread while the caller goes through the current one.
+    Transient errors are retried with exponential backoff.
+
+    :param columns: optional names of the columns to select instead of
+                    those of a "select *" query
     """
-    def __init__(self, query, limit=20, offset=0):
+    def __init__(self, query, limit=20, offset=0, max_limit=QUERY_MAX_LIMIT, columns=None, retries=QUERY_RETRIES):
+        if columns:
+            query = re.sub(r'^\s*select\s+\*', 'select ' + ', '.join(columns), query, flags=re.IGNORECASE)
         self.query = query
         self.limit = limit
+        self.max_limit = max(limit, max_limit)
         self.offset = offset
+        self.retries = retries
+        self._next = None
         self.fetch_batch_of_results()
 
-    def fetch_batch_of_results(self):
-        uri = "/evaluation/submission/query?query=" + urllib.quote_plus("%s limit %s offset %s" % (self.query, self.limit, self.offset))
-        results = syn.restGET(uri)
+    def _get_page(self, page):
+        offset, limit = page
+        uri = "/evaluation/submission/query?query=" + urllib.quote_plus("%s limit %s offset %s" % (self.query, limit, offset))
+        for retry in range(self.retries + 1):
+            try:
+                return syn.restGET(uri)
+            except (SynapseHTTPError, requests.exceptions.ConnectionError, requests.exceptions.Timeout) as ex1:
+                transient = not isinstance(ex1, SynapseHTTPError) or ex1.response is None or \
+                            ex1.response.status_code in TRANSIENT_STATUS_CODES
+                if not transient or retry == self.retries:
+                    raise
+                time.sleep(QUERY_RETRY_DELAY * 2 ** retry)
+
+    def _take(self, page, results):
+        offset, limit = page
         self.totalNumberOfResults = results['totalNumberOfResults']
         self.headers = results['headers']
         self.rows = results['rows']
         self.i = 0
+        next_offset = offset + len(self.rows)
+        ## a short page that isn't the last shows the page size of the server
+        if len(self.rows) < limit and next_offset < self.totalNumberOfResults:
+            self.max_limit = max(1, len(self.rows))
+        self.limit = min(self.limit * 2, self.max_limit)
+        self._next = None
+        if self.rows and next_offset < self.totalNumberOfResults:
+            self._next = prefetch.background(self._get_page, (next_offset, self.limit))
+
+    def fetch_batch_of_results(self):
+        page = (self.offset, self.limit)
+        self._take(page, self._get_page(page))
 
     def __iter__(self):
         return self
 
     def next(self):
         if self.i >= len(self.rows):
-            if self.offset >= self.totalNumberOfResults:
+            if self._next is None:
+                raise StopIteration()
+            page = self._next.item
+            self._take(page, self._next.wait())
+            if not self.rows:
                 raise StopIteration()
-            self.fetch_batch_of_results()
         values = self.rows[self.i]['values']
         self.i += 1
         self.offset += 1
         return values
 
 
-def validate(evaluation, dry_run=False):
+def prefetch_submissions(bundles):
+    """
+    Refetches the submission of each bundle to get its file path, with up
+    to PREFETCH_DEPTH downloads running ahead of the caller in background
+    threads
+
+    :returns: generator of (submission, status) in bundle order
+    """
+    ## to be later replaced by a "downloadFiles" flag on getSubmissionBundles
+    fetch = lambda bundle: syn.getSubmission(bundle[0])
+    for bundle, submission in prefetch.prefetch(fetch, bundles, PREFETCH_DEPTH):
+        yield submission, bundle[1]
+
+
+def process_submissions(evaluation, bundles, func, workers=1):
+    """
+    Runs func(evaluation, submission) on each submission bundle, on a pool
+    of worker processes when workers > 1. Workers only validate or score;
+    fetching submissions, storing statuses and sending messages stays in
+    this process so each happens exactly once per submission.
+
+    When sandboxed, each call runs in a child process of its own that is
+    killed once it goes over the SANDBOX limits in challenge_config, which
+    fails that submission with a LimitExceeded error and moves on.
+
+    :returns: generator of (submission, status, result, error) where error
+              is None or (exception, traceback text) if func raised
+    """
+    if sandboxed:
+        caller = sandbox.Sandbox(cpu_seconds=conf.SANDBOX_CPU_SECONDS, wall_seconds=conf.SANDBOX_WALL_SECONDS,
+                                 max_rss=conf.SANDBOX_MAX_RSS, initializer=conf.use_single_process)
+    else:
+        caller = worker_pool.call
+    if workers <= 1:
+        for submission, status in prefetch_submissions(bundles):
+            result, error = caller(func, evaluation, submission)
+            yield submission, status, result, error
+    else:
+        fetched = []
+        failed = []
+        ## a submission handed to the pool holds a slot until its outcome is
+        ## handled, so no more than workers submissions are out at once on
+        ## top of the PREFETCH_DEPTH downloads running ahead of them
+        slots = threading.Semaphore(workers - 1)
+        stopped = []
+        def arguments():
+            #runs in the pool's task thread, which hands each submission to
+            #a worker as soon as its file is downloaded. A failed download
+            #ends the run, as it does without workers, once the submissions
+            #already handed out are done.
+            try:
+                for submission, status in prefetch_submissions(bundles):
+                    fetched.append((submission, status))
+                    yield (evaluation, submission)
+                    slots.acquire()
+                    if stopped:
+                        return
+            except Exception:
+                failed.append(sys.exc_info())
+        outcomes = worker_pool.imap(func, arguments(), workers, initializer=conf.use_single_process, caller=caller)
+        try:
+            for i, result, error in outcomes:
+                slots.release()
+                submission, status = fetched[i]
+                yield submission, status, result, error
+        finally:
+            #the pool can only shut down once its task thread isn't waiting
+            #for a slot anymore
+            stopped.append(True)
+            slots.release()
+            outcomes.close()
+        if failed:
+            raise failed[0][0], failed[0][1], failed[0][2]
+
+
+def acquire_stage_lock(stage, evaluation_id=None):
+    """
+    Takes the lock of one stage of one queue, like validating or scoring
+    it, so other runs can work on other queues and stages meanwhile
+
+    :returns: the held lock, or None if another run holds it
+    """
+    name = lock.lock_name('challenge', stage, evaluation_id)
+    try:
+        return lock.acquire_lock_or_fail(name, max_age=STAGE_LOCK_MAX_AGE,
+                                         timeout=lock_timeout, heartbeat=STAGE_LOCK_HEARTBEAT)
+    except lock.LockedException as ex1:
+        print "Skipping %s of %s: %s" % (stage, evaluation_id, ex1)
+        return None
+
+
+def acquire_stage_locks(stage, evaluation_ids):
+    """
+    Takes the lock of one stage of several queues, all of them or none
+
+    :returns: list of the held locks, or None if another run holds any
+    """
+    held = []
+    for evaluation_id in evaluation_ids:
+        one = acquire_stage_lock(stage, evaluation_id)
+        if one is None:
+            for other in held:
+                other.release()
+            return None
+        held.append(one)
+    return held
+
+
+def stage_locked(stage):
+    """
+    Decorates a function of an evaluation to run only while holding the
+    lock of that stage of that queue. It returns 0 without running when
+    another run holds the lock.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def locked(evaluation, *args, **kwargs):
+            evaluation_id = evaluation.id if isinstance(evaluation, Evaluation) else evaluation
+            held = acquire_stage_lock(stage, evaluation_id)
+            if held is None:
+                return 0
+            try:
+                return func(evaluation, *args, **kwargs)
+            finally:
+                held.release()
+        return locked
+    return decorator
+
+
+@stage_locked('validate')
+def validate(evaluation, dry_run=False, workers=1):
 
     if type(evaluation) != Evaluation:
         evaluation = syn.getEvaluation(evaluation)
@@ -176,58 +474,78 @@ def validate(evaluation, dry_run=False):
     print "-" * 60
     sys.stdout.flush()
 
+    count = 0
+    bundles = syn.getSubmissionBundles(evaluation, status='RECEIVED')
+    with status_buffer_for(evaluation, dry_run) as statuses:
+        for submission, status, result, error in process_submissions(evaluation, bundles, conf.validate_submission, workers):
+            count += 1
 
-    for submission, status in syn.getSubmissionBundles(evaluation, status='RECEIVED'):
+            print "validating", submission.id, submission.name
+            ex1 = None
+            if error is None:
+                is_valid, validation_message = result
+            else:
+                ex1, st = error
+                is_valid = False
+                print "Exception during validation:", type(ex1), ex1, ex1.message
+                sys.stderr.write(st)
+                validation_message = str(ex1)
+
+            status.status = "VALIDATED" if is_valid else "INVALID"
+            if not is_valid:
+                failure_reason = {"FAILURE_REASON":validation_message}
+                add_annotations = synapseclient.annotations.to_submission_status_annotations(failure_reason,is_private=True)
+                status = update_single_submission_status(status, add_annotations)
+
+            ## send message AFTER storing status to ensure we don't get repeat messages
+            statuses.add(status, on_stored=indexed(submission, file_md5(submission), functools.partial(
+                send_validation_messages, evaluation, submission, is_valid, validation_message, ex1), dry_run))
+
+    return count
+
+
+def send_validation_messages(evaluation, submission, is_valid, validation_message, ex1, status):
+    profile = get_profile(submission.userId)
+    if is_valid:
+        messages.validation_passed(
+            userIds=[submission.userId],
+            username=get_user_name(profile),
+            queue_name=evaluation.name,
+            submission_id=submission.id,
+            submission_name=submission.name)
+    else:
+        ## a submission too big or slow to validate is the submitter's to fix
+        if isinstance(ex1, (AssertionError, sandbox.LimitExceeded)):
+            sendTo = [submission.userId]
+            username = get_user_name(profile)
+        else:
+            sendTo = conf.ADMIN_USER_IDS
+            username = "Challenge Administrator"
 
-        ## refetch the submission so that we get the file path
-        ## to be later replaced by a "downloadFiles" flag on getSubmissionBundles
-        submission = syn.getSubmission(submission)
+        messages.validation_failed(
+            userIds= sendTo,
+            username=username,
+            queue_name=evaluation.name,
+            submission_id=submission.id,
+            submission_name=submission.name,
+            message=validation_message)
 
-        print "validating", submission.id, submission.name
-        try:
-            is_valid, validation_message = conf.validate_submission(evaluation, submission)
-        except Exception as ex1:
-            is_valid = False
-            print "Exception during validation:", type(ex1), ex1, ex1.message
-            traceback.print_exc()
-            validation_message = str(ex1)
-
-        status.status = "VALIDATED" if is_valid else "INVALID"
-        if not is_valid:
-            failure_reason = {"FAILURE_REASON":validation_message}
-            add_annotations = synapseclient.annotations.to_submission_status_annotations(failure_reason,is_private=True)
-            status = update_single_submission_status(status, add_annotations)
 
-        if not dry_run:
-            status = syn.store(status)
-
-        ## send message AFTER storing status to ensure we don't get repeat messages
-        profile = syn.getUserProfile(submission.userId)
-        if is_valid:
-            messages.validation_passed(
-                userIds=[submission.userId],
-                username=get_user_name(profile),
-                queue_name=evaluation.name,
-                submission_id=submission.id,
-                submission_name=submission.name)
-        else:
-            if isinstance(ex1, AssertionError):
-                sendTo = [submission.userId]
-                username = get_user_name(profile)
-            else:
-                sendTo = conf.ADMIN_USER_IDS
-                username = "Challenge Administrator"
+def batch_scored_submissions(evaluation, bundles):
+    """
+    Scores every submission bundle together with conf.score_submissions
 
-            messages.validation_failed(
-                userIds= sendTo,
-                username=username,
-                queue_name=evaluation.name,
-                submission_id=submission.id,
-                submission_name=submission.name,
-                message=validation_message)
+    :returns: list of (submission, status, result, error) as returned by
+              process_submissions
+    """
+    bundles = list(prefetch_submissions(bundles))
+    results = conf.score_submissions(evaluation, [submission for submission, status in bundles])
+    return [(submission, status, result, worker_pool.describe(exc_info) if exc_info else None)
+            for (submission, status), (result, exc_info) in zip(bundles, results)]
 
 
-def score(evaluation, dry_run=False):
+@stage_locked('score')
+def score(evaluation, dry_run=False, batch=False, workers=1):
 
     if type(evaluation) != Evaluation:
         evaluation = syn.getEvaluation(evaluation)
@@ -236,75 +554,94 @@ def score(evaluation, dry_run=False):
     print "-" * 60
     sys.stdout.flush()
 
-    for submission, status in syn.getSubmissionBundles(evaluation, status='VALIDATED'):
-
-        status.status = "INVALID"
-
-        ## refetch the submission so that we get the file path
-        ## to be later replaced by a "downloadFiles" flag on getSubmissionBundles
-        submission = syn.getSubmission(submission)
-
-        try:
-            score, message = conf.score_submission(evaluation, submission)
-
-            print "scored:", submission.id, submission.name, submission.userId, score
-
-            ## fill in team in submission status annotations
-            if 'teamId' in submission:
-                team = syn.restGET('/team/{id}'.format(id=submission.teamId))
-                if 'name' in team:
-                    score['team'] = team['name']
-                else:
-                    score['team'] = submission.teamId
-            elif 'userId' in submission:
-                profile = syn.getUserProfile(submission.userId)
-                score['team'] = get_user_name(profile)
-            else:
-                score['team'] = '?'
-            add_annotations = synapseclient.annotations.to_submission_status_annotations(score,is_private=True)
-            status = update_single_submission_status(status, add_annotations)
+    bundles = syn.getSubmissionBundles(evaluation, status='VALIDATED')
+    if batch:
+        scored_submissions = batch_scored_submissions(evaluation, bundles)
+    else:
+        scored_submissions = process_submissions(evaluation, bundles, conf.score_submission, workers)
+
+    count = 0
+    ## the leaderboard reads its table on the first row, if any
+    leaderboard = leaderboard_sync.LeaderboardSync(syn, conf.leaderboard_tables.get(evaluation.id), dry_run=dry_run)
+    with status_buffer_for(evaluation, dry_run) as statuses, leaderboard:
+        for submission, status, result, error in scored_submissions:
+            count += 1
+
+            status.status = "INVALID"
+
+            if error is None:
+                try:
+                    score, message = result
+
+                    print "scored:", submission.id, submission.name, submission.userId, score
+
+                    ## fill in team in submission status annotations
+                    if 'teamId' in submission:
+                        team = get_team(submission.teamId)
+                        if 'name' in team:
+                            score['team'] = team['name']
+                        else:
+                            score['team'] = submission.teamId
+                    elif 'userId' in submission:
+                        profile = get_profile(submission.userId)
+                        score['team'] = get_user_name(profile)
+                    else:
+                        score['team'] = '?'
+                    add_annotations = synapseclient.annotations.to_submission_status_annotations(score,is_private=True)
+                    status = update_single_submission_status(status, add_annotations)
+
+                    status.status = "SCORED"
+                    ## if there's a table configured, update it when the run ends
+                    if evaluation.id in conf.leaderboard_tables:
+                        update_leaderboard_table(leaderboard, submission, fields=score)
+                    if not dry_run:
+                        _mirror().upsert(evaluation.id, leaderboard_columns_of(evaluation.id), submission, score)
+
+                except Exception:
+                    error = worker_pool.describe(sys.exc_info())
+
+            if error is not None:
+                sys.stderr.write('\n\nError scoring submission %s %s:\n' % (submission.name, submission.id))
+                sys.stderr.write(error[1])
+                sys.stderr.write('\n')
+                message = error[1]
+
+                if isinstance(error[0], sandbox.LimitExceeded):
+                    failure_reason = {"FAILURE_REASON":str(error[0])}
+                    add_annotations = synapseclient.annotations.to_submission_status_annotations(failure_reason,is_private=True)
+                    status = update_single_submission_status(status, add_annotations)
+
+                if conf.ADMIN_USER_IDS:
+                    submission_info = "submission id: %s\nsubmission name: %s\nsubmitted by user id: %s\n\n" % (submission.id, submission.name, submission.userId)
+                    messages.error_notification(userIds=conf.ADMIN_USER_IDS, message=submission_info+error[1])
+
+            ## send message AFTER storing status to ensure we don't get repeat messages
+            statuses.add(status, on_stored=indexed(submission, file_md5(submission), functools.partial(
+                send_scoring_messages, evaluation, submission, message), dry_run))
 
-            status.status = "SCORED"
-            ## if there's a table configured, update it
-            if not dry_run and evaluation.id in conf.leaderboard_tables:
-                update_leaderboard_table(conf.leaderboard_tables[evaluation.id], submission, fields=score, dry_run=False)
+    sys.stdout.write('\n')
+    return count
 
-        except Exception as ex1:
-            sys.stderr.write('\n\nError scoring submission %s %s:\n' % (submission.name, submission.id))
-            st = StringIO()
-            traceback.print_exc(file=st)
-            sys.stderr.write(st.getvalue())
-            sys.stderr.write('\n')
-            message = st.getvalue()
 
-            if conf.ADMIN_USER_IDS:
-                submission_info = "submission id: %s\nsubmission name: %s\nsubmitted by user id: %s\n\n" % (submission.id, submission.name, submission.userId)
-                messages.error_notification(userIds=conf.ADMIN_USER_IDS, message=submission_info+st.getvalue())
+def send_scoring_messages(evaluation, submission, message, status):
+    profile = get_profile(submission.userId)
 
-        if not dry_run:
-            status = syn.store(status)
-
-        ## send message AFTER storing status to ensure we don't get repeat messages
-        profile = syn.getUserProfile(submission.userId)
-
-        if status.status == 'SCORED':
-            messages.scoring_succeeded(
-                userIds=[submission.userId],
-                message=message,
-                username=get_user_name(profile),
-                queue_name=evaluation.name,
-                submission_name=submission.name,
-                submission_id=submission.id)
-        else:
-            messages.scoring_error(
-                userIds=conf.ADMIN_USER_IDS,
-                message=message,
-                username="Challenge Administrator,",
-                queue_name=evaluation.name,
-                submission_name=submission.name,
-                submission_id=submission.id)
-
-    sys.stdout.write('\n')
+    if status.status == 'SCORED':
+        messages.scoring_succeeded(
+            userIds=[submission.userId],
+            message=message,
+            username=get_user_name(profile),
+            queue_name=evaluation.name,
+            submission_name=submission.name,
+            submission_id=submission.id)
+    else:
+        messages.scoring_error(
+            userIds=conf.ADMIN_USER_IDS,
+            message=message,
+            username="Challenge Administrator,",
+            queue_name=evaluation.name,
+            submission_name=submission.name,
+            submission_id=submission.id)
 
 
 def create_leaderboard_table(evaluation,cols,name,parent, dry_run=False):
@@ -313,56 +650,36 @@ def create_leaderboard_table(evaluation,cols,name,parent, dry_run=False):
         schema = syn.store(Schema(name=name, columns=cols, parent=parent))
     else:
         schema = syn.get(temp['results'][0]['table.id'])
-    temp = syn.tableQuery('select * from %s' % schema.id)
-
-    df = temp.asDataFrame()
-    for submission, status in syn.getSubmissionBundles(evaluation,status='SCORED'):
-        annotations = synapseclient.annotations.from_submission_status_annotations(status.annotations) if 'annotations' in status else {}
-        update_leaderboard_table(df,schema.id,  submission, annotations)
 
-def update_leaderboard_table(df, tableId, submission, fields, dry_run=False):
+    published = []
+    with leaderboard_sync.LeaderboardSync(syn, schema.id, dry_run=dry_run) as leaderboard:
+        for status in submission_statuses(evaluation, 'SCORED'):
+            ## skip submissions whose status hasn't changed since they were
+            ## published, without fetching them
+            if _states().published(status.id, status.get('etag')):
+                continue
+            submission = syn.getSubmission(status.id, downloadFile=False)
+            annotations = synapseclient.annotations.from_submission_status_annotations(status.annotations) if 'annotations' in status else {}
+            update_leaderboard_table(leaderboard, submission, annotations)
+            published.append((submission, status))
+
+    ## only once the rows are written
+    if not dry_run:
+        for submission, status in published:
+            _states().record(submission, status)
+            _states().mark_published(submission.id, status.get('etag'))
+    print "Leaderboard %s: %d rows inserted, %d updated" % (schema.id, leaderboard.inserted, leaderboard.updated)
+
+
+def update_leaderboard_table(leaderboard, submission, fields):
     """
     Insert or update a record in a leaderboard table for a submission.
+    The record is written when the leaderboard flushes.
 
+    :param leaderboard: a leaderboard_sync.LeaderboardSync for the table
     :param fields: a dictionary including all scoring statistics plus the team name for the submission.
     """
-
-    ## copy fields from submission
-    ## fields should already contain scoring stats
-    fields['objectId'] = submission.id
-    fields['userId'] = submission.userId
-    fields['entityId'] = submission.entityId
-    fields['versionNumber'] = submission.versionNumber
-    fields['name'] = submission.name
-
-    #results = syn.tableQuery("select * from %s where objectId=%s" % (leaderboard_table, submission.id), resultsAs="rowset")
-    #rowset = results.asRowSet()
-    if sum(df['objectId'].isin([int(submission.id)])) == 0:
-        mode='insert'
-    elif sum(df['objectId'].isin([int(submission.id)]))  == 1:
-        mode = 'update'
-    else:
-        ## shouldn't happen
-        raise RuntimeError("Multiple entries in leaderboard table %s for submission %s" % (leaderboard_table,submission.id))
-    row = [fields.get(col, None) for col in df.columns.values]
-
-    ## figure out if we're inserting or updating
-    #if len(rowset['rows']) == 0:
-    #    row = {'values':[]}
-    #    rowset['rows'].append(row)
-    #    mode = 'insert'
-    #    print(row)
-    #elif len(rowset['rows']) == 1:
-    #    row = rowset['rows'][0]
-    #    mode = 'update'
-    
-    ## build list of fields in proper order according to headers
-    #row['values'] = [fields.get(col['name'], None) for col in rowset['headers']]
-    if dry_run:
-        print mode, "row "+row['rowId'] if 'rowId' in row else "new row", row['values']
-    else:
-        if mode == 'insert':
-            return syn.store(synapseclient.Table(tableId, [row]))
+    leaderboard.add(submission, fields)
 
 
 def query(evaluation, columns, out=sys.stdout):
@@ -373,18 +690,29 @@ def query(evaluation, columns, out=sys.stdout):
 
     ## Note: Constructing the index on which the query operates is an
     ## asynchronous process, so we may need to wait a bit.
-    results = Query(query="select * from evaluation_%s where status==\"SCORED\"" % evaluation.id)
+    results = Query(query="select * from evaluation_%s where status==\"SCORED\"" % evaluation.id,
+                    columns=[column['name'] for column in columns])
+
+    write_leaderboard(out, columns, results.headers, results)
 
+
+def write_leaderboard(out, columns, headers, rows):
+    """
+    Writes a leaderboard as CSV, the columns in the given order that are
+    among headers, the names of the values in each row
+    """
     ## annotate each column with it's position in the query results, if it's there
     cols = copy.deepcopy(columns)
     for column in cols:
-        if column['name'] in results.headers:
-            column['index'] = results.headers.index(column['name'])
+        if column['name'] in headers:
+            column['index'] = headers.index(column['name'])
     indices = [column['index'] for column in cols if 'index' in column]
     column_index = {column['index']:column for column in cols if 'index' in column}
 
     def column_to_string(row, column_index, i):
-        if column_index[i]['columnType']=="DOUBLE":
+        if row[i] is None:
+            return ""
+        elif column_index[i]['columnType']=="DOUBLE":
             return "%0.6f"%float(row[i])
         elif column_index[i]['columnType']=="STRING":
             return "\"%s\""%unicode(row[i]).encode('utf-8')
@@ -393,18 +721,45 @@ def query(evaluation, columns, out=sys.stdout):
 
     ## print leaderboard
     out.write(",".join([column['name'] for column in cols if 'index' in column]) + "\n")
-    for row in results:
+    for row in rows:
         out.write(",".join(column_to_string(row, column_index, i) for i in indices))
         out.write("\n")
 
 
-def list_submissions(evaluation, status=None, **kwargs):
+def local_leaderboard(evaluation, columns, out=sys.stdout):
+    """Writes the leaderboard of an evaluation from the local mirror"""
+    headers, rows = _mirror().rows(utils.id_of(evaluation), [column['name'] for column in columns])
+    write_leaderboard(out, columns, headers, rows)
+
+
+def sync_leaderboard_mirror(evaluation):
+    """
+    Updates the local mirror of the leaderboard of an evaluation from its
+    SCORED submissions, rebuilding only the rows whose status changed
+    """
+    evaluation_id = utils.id_of(evaluation)
+    annotations = lambda status: from_submission_status_annotations(status.annotations) if 'annotations' in status else {}
+    rebuilt, dropped = _mirror().sync(evaluation_id, leaderboard_columns_of(evaluation_id),
+                                      syn.getSubmissionBundles(evaluation, status='SCORED'), annotations)
+    print "Leaderboard mirror of %s: %d rows rebuilt, %d dropped" % (evaluation_id, rebuilt, dropped)
+
+
+def list_submissions(evaluation, status=None, local=False, **kwargs):
+    if local:
+        ## answered from the state index, as of the last run that saw each submission
+        print '\n\nIndexed submissions for: %s' % utils.id_of(evaluation)
+        print '-' * 60
+        for state in _states().submissions(utils.id_of(evaluation), status):
+            print state['id'], state['created_on'], state['status'], (state['name'] or '').encode('utf-8'), state['user_id']
+        return
+
     if isinstance(evaluation, basestring):
         evaluation = syn.getEvaluation(evaluation)
     print '\n\nSubmissions for: %s %s' % (evaluation.id, evaluation.name.encode('utf-8'))
     print '-' * 60
 
     for submission, status in syn.getSubmissionBundles(evaluation, status=status):
+        _states().record(submission, status)
         print submission.id, submission.createdOn, status.status, submission.name.encode('utf-8'), submission.userId
 
 
@@ -460,62 +815,90 @@ def archive(evaluation, destination=None, name=None, query=None):
     print "created:", entity.id, entity.name
     return entity.id
 
-def sorting(dfcolumn,ascending=False):
-    i=1
-    ranking=[1]
-    sorteddf = dfcolumn.sort_values(ascending=ascending)
-    first = sorteddf[0]
-    for value in sorteddf[1:]:
-        if value == first:
-            ranking.append(i)
-        else:
-            i = i+1
-            ranking.append(i)
-        first = value
-    return(ranking)
-
-def addRanking_SC1_2(x):
-    temp = syn.getSubmissionStatus(x['objectId'])
-    #AUPRpVal_boolean = filter(lambda input: input.get('key', None) == "AUPRpVal_boolean", temp.annotations['stringAnnos'])[0]
-    #AUPRpVal_boolean['value'] = x['AUPRpVal_boolean']
-    #AUROCpVal_boolean = filter(lambda input: input.get('key', None) == "AUROCpVal_boolean", temp.annotations['stringAnnos'])[0]
-    #AUROCpVal_boolean['value'] = x['AUROCpVal_boolean']
-    finalRank = filter(lambda input: input.get('key', None) == "finalRank", temp.annotations['longAnnos'])[0]
-    finalRank['value'] = x['final_rank']
-    syn.store(temp)
-
-
-def addRanking_SC3(x):
-    temp = syn.getSubmissionStatus(x['objectId'])
-    #booleanpVal = filter(lambda input: input.get('key', None) == "booleanpVal", temp.annotations['stringAnnos'])[0]
-    #booleanpVal['value'] = x['pVal_boolean']
-    finalRank = filter(lambda input: input.get('key', None) == "finalRank", temp.annotations['longAnnos'])[0]
-    finalRank['value'] = x['final_rank']
-    syn.store(temp)
-
-
-def SC1_2_ranking(synId):
-    rankings = syn.tableQuery('SELECT * FROM %s' % synId)
-    rankingsdf = rankings.asDataFrame()
-    rankingsdf = rankingsdf.sort_values('AUPR',ascending=False)
-    rankingsdf['AUPR_rank'] = sorting(rankingsdf['AUPR'])
-    rankingsdf = rankingsdf.sort_values('AUROC',ascending=False)
-    rankingsdf['AUROC_rank'] = sorting(rankingsdf['AUROC'])
-    rankingsdf['average_rank'] = (rankingsdf['AUPR_rank'] + rankingsdf['AUROC_rank'])/2
-    rankingsdf = rankingsdf.sort_values('average_rank',ascending=True)
-    rankingsdf['final_rank'] = sorting(rankingsdf['average_rank'],True)
-    rankingsdf['AUPRpVal_boolean'] = rankingsdf['nAUPR_pVal'] < 0.05
-    rankingsdf['AUROCpVal_boolean'] = rankingsdf['nAUROC_pVal'] < 0.05
-    rankingsdf.apply(lambda x: addRanking_SC1_2(x),axis=1)
-
-def SC3_ranking(synId):
+def submission_statuses(evaluation, status, limit=QUERY_MAX_LIMIT):
+    """
+    The statuses of the submissions to an evaluation that are in status,
+    paged without the submissions themselves
+
+    :returns: generator of SubmissionStatus
+    """
+    uri = "/evaluation/%s/submission/status/all?status=%s" % (utils.id_of(evaluation), status)
+    for result in syn._GET_paginated(uri, limit=limit):
+        yield SubmissionStatus(**result)
+
+
+def scored_statuses(evaluation):
+    """
+    The status of every SCORED submission to an evaluation, by submission ID,
+    from one paged listing rather than a request per submission
+    """
+    return {str(submission.id): status for submission, status in syn.getSubmissionBundles(evaluation, status='SCORED')}
+
+
+def write_ranks(evaluation, rankingsdf):
+    """
+    Sets the finalRank annotation of each ranked submission, uploading only
+    the statuses whose rank changed, in batches
+    """
+    statuses_by_id = scored_statuses(evaluation)
+    changed = 0
+    with status_buffer_for(evaluation) as statuses:
+        for objectId, rank in izip(rankingsdf['objectId'], rankingsdf['final_rank']):
+            status = statuses_by_id.get(str(objectId))
+            if status is not None and ranking.set_rank(status, int(rank)):
+                statuses.add(status)
+                changed += 1
+    print "Ranked %d submissions, %d ranks changed" % (len(rankingsdf), changed)
+
+
+def incremental_ranking(evaluation):
+    """
+    Brings the saved rank index of the evaluation in line with its SCORED
+    submissions and updates finalRank only for the submissions whose rank
+    moved. Every run lists the SCORED statuses, so submissions scored on
+    any host are ranked and those that left SCORED are dropped, but only
+    the submissions whose scores changed are ranked again.
+    """
+    config = conf.config_evaluations_map[evaluation]
+    index = rank_index.load(evaluation, config['rank_metrics'])
+
+    statuses = {str(status.id): status for status in submission_statuses(evaluation, 'SCORED')}
+    scores = []
+    for objectId, status in statuses.iteritems():
+        fields = from_submission_status_annotations(status.annotations) if 'annotations' in status else {}
+        if not index.holds(objectId, fields):
+            scores.append((objectId, fields))
+    removed = [objectId for objectId in index.ranks() if objectId not in statuses]
+    changed = index.upsert_many(scores, removed=removed)
+
+    with status_buffer_for(evaluation) as buffer:
+        for objectId, rank in changed.iteritems():
+            if ranking.set_rank(statuses[objectId], rank):
+                buffer.add(statuses[objectId])
+
+    rank_index.save(evaluation, index)
+    print "Ranked %d new or rescored submissions, dropped %d, %d ranks changed" % (len(scores), len(removed), len(changed))
+
+
+def leaderboard_frame(synId, evaluation, columns, local=False):
+    """
+    The given columns of a leaderboard as a DataFrame, from the local
+    mirror or else from the leaderboard table synId
+    """
+    if local:
+        return _mirror().frame(evaluation, columns)
+    return syn.tableQuery('SELECT %s FROM %s' % (', '.join(columns), synId)).asDataFrame()
+
+def SC1_2_ranking(synId, evaluation, local=False):
+    rankings = leaderboard_frame(synId, evaluation, ['objectId', 'AUPR', 'AUROC', 'nAUPR_pVal', 'nAUROC_pVal'], local)
+    rankingsdf = ranking.sc1_2_ranks(rankings, conf.PVALUE_THRESHOLD)
+    write_ranks(evaluation, rankingsdf)
+
+def SC3_ranking(synId, evaluation, local=False):
    ##### SC3
-    rankings = syn.tableQuery('SELECT * FROM %s' % synId)
-    rankingsdf = rankings.asDataFrame()
-    rankingsdf = rankingsdf.sort_values('score',ascending=False)
-    rankingsdf['final_rank'] = sorting(rankingsdf['score'])
-    rankingsdf['pVal_boolean'] = rankingsdf['pVal'] < 0.05
-    rankingsdf.apply(lambda x: addRanking_SC3(x),axis=1) 
+    rankings = leaderboard_frame(synId, evaluation, ['objectId', 'score', 'pVal'], local)
+    rankingsdf = ranking.sc3_ranks(rankings, conf.PVALUE_THRESHOLD)
+    write_ranks(evaluation, rankingsdf)
 
 ## ==================================================
 ##  Handlers for commands
@@ -529,17 +912,24 @@ def command_list(args):
     if args.all:
         for queue_info in conf.evaluation_queues:
             list_submissions(evaluation=queue_info['id'],
-                             status=args.status)
+                             status=args.status, local=args.local)
     elif args.challenge_project:
         list_evaluations(project=args.challenge_project)
     elif args.evaluation:
         list_submissions(evaluation=args.evaluation,
-                         status=args.status)
+                         status=args.status, local=args.local)
     else:
         list_evaluations(project=conf.CHALLENGE_SYN_ID)
 
 
 def command_check_status(args):
+    if args.local:
+        state = _states().get(args.submission)
+        if state is None:
+            print "Submission %s isn't in the state index" % args.submission
+        else:
+            print json.dumps(state, indent=2, sort_keys=True)
+        return
     submission = syn.getSubmission(args.submission)
     status = syn.getSubmissionStatus(args.submission)
     evaluation = syn.getEvaluation(submission.evaluationId)
@@ -551,40 +941,148 @@ def command_check_status(args):
     print unicode(status).encode('utf-8')
 
 
+@stage_locked('score')
+def reset_scored(evaluation, new_status, dry_run=False):
+    """
+    Sets the status of every SCORED submission to an evaluation to
+    new_status, while no run is scoring it
+    """
+    show = None if dry_run else lambda status: sys.stdout.write(unicode(status).encode('utf-8') + '\n')
+    with status_buffer_for(evaluation, dry_run=dry_run) as statuses:
+        for submission, status in syn.getSubmissionBundles(evaluation, status="SCORED"):
+            status.status = new_status
+            statuses.add(status, on_stored=show)
+
+
+@stage_locked('score')
+def reset_submission(evaluation, submission_id, new_status, dry_run=False):
+    """
+    Sets the status of one submission to an evaluation to new_status, while
+    no run is scoring it
+    """
+    status = syn.getSubmissionStatus(submission_id)
+    status.status = new_status
+    if not dry_run:
+        print unicode(syn.store(status)).encode('utf-8')
+
+
 def command_reset(args):
     if args.rescore_all:
         for queue_info in conf.evaluation_queues:
-            for submission, status in syn.getSubmissionBundles(queue_info['id'], status="SCORED"):
-                status.status = args.status
-                if not args.dry_run:
-                    print unicode(syn.store(status)).encode('utf-8')
-    for submission in args.submission:
-        status = syn.getSubmissionStatus(submission)
-        status.status = args.status
-        if not args.dry_run:
-            print unicode(syn.store(status)).encode('utf-8')
+            reset_scored(queue_info['id'], args.status, dry_run=args.dry_run)
+    for submission_id in args.submission:
+        evaluation_id = syn.getSubmission(submission_id, downloadFile=False).evaluationId
+        reset_submission(evaluation_id, submission_id, args.status, dry_run=args.dry_run)
 
 
 def command_validate(args):
+    conf.preload_goldstandards()
+    preload_lookups()
     if args.all:
         for queue_info in conf.evaluation_queues:
-            validate(queue_info['id'], dry_run=args.dry_run)
+            validate(queue_info['id'], dry_run=args.dry_run, workers=args.workers)
     elif args.evaluation:
-        validate(args.evaluation, dry_run=args.dry_run)
+        validate(args.evaluation, dry_run=args.dry_run, workers=args.workers)
     else:
         sys.stderr.write("\nValidate command requires either an evaluation ID or --all to validate all queues in the challenge")
 
 
 def command_score(args):
+    conf.preload_goldstandards()
+    preload_lookups()
     if args.all:
         for queue_info in conf.evaluation_queues:
-            score(queue_info['id'], dry_run=args.dry_run)
+            score(queue_info['id'], dry_run=args.dry_run, batch=args.batch, workers=args.workers)
     elif args.evaluation:
-        score(args.evaluation, dry_run=args.dry_run)
+        score(args.evaluation, dry_run=args.dry_run, batch=args.batch, workers=args.workers)
     else:
         sys.stderr.write("\Score command requires either an evaluation ID or --all to score all queues in the challenge")
 
 
+def command_daemon(args):
+    """
+    Validates and scores every queue in rounds, in one long running
+    process, until SIGTERM or SIGINT. Each queue is scored straight after
+    it is validated. The wait between rounds doubles from --min-interval
+    up to --max-interval while there is nothing to do, and drops back as
+    soon as a round handles a submission.
+    """
+    ## one daemon per directory, cron runs still get the queues in between
+    daemon_lock = lock.acquire_lock_or_fail(lock.lock_name('challenge', 'daemon'), max_age=STAGE_LOCK_MAX_AGE,
+                                            timeout=lock_timeout, heartbeat=STAGE_LOCK_HEARTBEAT)
+    try:
+        _run_daemon(args)
+    finally:
+        daemon_lock.release()
+
+
+def _run_daemon(args):
+    conf.preload_goldstandards()
+
+    daemon_pid = os.getpid()
+    stopping = []
+    def stop(signum, frame):
+        if os.getpid() != daemon_pid:
+            ## a forked worker: die as it would without the handler
+            signal.signal(signum, signal.SIG_DFL)
+            os.kill(os.getpid(), signum)
+            return
+        print "Received signal %d, stopping after the current step" % signum
+        stopping.append(signum)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    interval = args.min_interval
+    while not stopping:
+        count = 0
+        try:
+            preload_lookups()
+            for queue_info in conf.evaluation_queues:
+                if stopping:
+                    break
+                count += validate(queue_info['id'], dry_run=args.dry_run, workers=args.workers)
+                if stopping:
+                    break
+                count += score(queue_info['id'], dry_run=args.dry_run, batch=args.batch, workers=args.workers)
+        except Exception:
+            sys.stderr.write('Error in scoring daemon:\n')
+            st = StringIO()
+            traceback.print_exc(file=st)
+            sys.stderr.write(st.getvalue())
+            sys.stderr.write('\n')
+
+            if conf.ADMIN_USER_IDS:
+                messages.error_notification(userIds=conf.ADMIN_USER_IDS, message=st.getvalue(), queue_name=conf.CHALLENGE_NAME)
+
+        messages.send_digests()
+        sys.stdout.flush()
+
+        interval = args.min_interval if count else min(interval * 2, args.max_interval)
+        waited = 0
+        while waited < interval and not stopping:
+            time.sleep(1)
+            waited += 1
+
+    print "Scoring daemon stopped"
+
+
+def command_invalidate_scores(args):
+    if args.all or args.evaluation or args.md5:
+        ## cached scores of a file or of every file may belong to any queue
+        evaluation_ids = [args.evaluation] if args.evaluation else [queue_info['id'] for queue_info in conf.evaluation_queues]
+        held = acquire_stage_locks('score', evaluation_ids)
+        if held is None:
+            return
+        try:
+            removed = conf.invalidate_scores(evaluation=args.evaluation, md5=args.md5)
+        finally:
+            for one in held:
+                one.release()
+        print "Removed %d cached scores" % removed
+    else:
+        sys.stderr.write("\nInvalidate-scores command requires an evaluation ID, --md5 or --all")
+
+
 def command_rank(args):
     evaluation = int(args.evaluation)
     # evaluationFunc = {5821575:SC1_2_ranking,5821583:SC1_2_ranking,5821621:SC3_ranking}
@@ -592,7 +1090,16 @@ def command_rank(args):
     evaluationFunc = {7991328:SC1_2_ranking,7991330:SC1_2_ranking,7991332:SC3_ranking}
     eval_synId = {7991328:"syn7992323",7991330:"syn7992305",7991332:"syn7992324"}
     #eval_functions = evaluationFunc[evaluation]
-    evaluationFunc[evaluation](eval_synId[evaluation])
+    held = acquire_stage_lock('rank', evaluation)
+    if held is None:
+        return
+    try:
+        if args.incremental:
+            incremental_ranking(evaluation)
+        else:
+            evaluationFunc[evaluation](eval_synId[evaluation], evaluation, local=args.local)
+    finally:
+        held.release()
     #SC1_2_ranking("syn6088407")
     #SC1_2_ranking("syn6088408")
     #SC3_ranking("syn6088409")
@@ -602,22 +1109,32 @@ def command_rank(args):
 
 def command_leaderboard(args):
     ## show columns specific to an evaluation, if available
-    leaderboard_cols = conf.leaderboard_columns.get(args.evaluation, conf.LEADERBOARD_COLUMNS)
+    leaderboard_cols = leaderboard_columns_of(args.evaluation)
+
+    if args.sync:
+        sync_leaderboard_mirror(args.evaluation)
+    write = local_leaderboard if args.local or args.sync else query
 
     ## write out to file if --out args given
     if args.out is not None:
         with open(args.out, 'w') as f:
-            query(args.evaluation, columns=leaderboard_cols, out=f)
+            write(args.evaluation, columns=leaderboard_cols, out=f)
         print "Wrote leaderboard out to:", args.out
     else:
-        query(args.evaluation, columns=leaderboard_cols)
+        write(args.evaluation, columns=leaderboard_cols)
 
 
 def command_archive(args):
     evaluation = int(args.evaluation)
     #evaluationName = {5821575:"RV-SC1",5821583:"RV-SC2",5821621:"RV-SC3"}
     evaluationName = {7991328:"RV-SC1_test",7991330:"RV-SC2_test",7991332:"RV-SC3_test"}
-    create_leaderboard_table(evaluation, conf.leaderboard_columns[evaluation], evaluationName[evaluation], "syn5641757", args.dry_run)
+    held = acquire_stage_lock('archive', evaluation)
+    if held is None:
+        return
+    try:
+        create_leaderboard_table(evaluation, conf.leaderboard_columns[evaluation], evaluationName[evaluation], "syn5641757", args.dry_run)
+    finally:
+        held.release()
     #archive(args.evaluation, args.destination, name=args.name, query=args.query)
 
 
@@ -630,7 +1147,7 @@ def main():
     if conf.CHALLENGE_SYN_ID == "":
         sys.stderr.write("Please configure your challenge. See sample_challenge.py for an example.")
 
-    global syn
+    global syn, lookups, lock_timeout, mirror, sandboxed, states
 
     parser = argparse.ArgumentParser()
 
@@ -641,6 +1158,8 @@ def main():
     parser.add_argument("--acknowledge-receipt", help="Send confirmation message on passing validation to participants", action="store_true", default=False)
     parser.add_argument("--dry-run", help="Perform the requested command without updating anything in Synapse", action="store_true", default=False)
     parser.add_argument("--debug", help="Show verbose error output from Synapse API calls", action="store_true", default=False)
+    parser.add_argument("--sandbox", help="Validate and score each submission in a child process with the CPU, time and memory limits in challenge_config (not with score --batch)", action="store_true", default=False)
+    parser.add_argument("--lock-timeout", help="Seconds to wait for a queue another run is working on before skipping it", type=int, default=0)
 
     subparsers = parser.add_subparsers(title="subcommand")
 
@@ -649,10 +1168,12 @@ def main():
     parser_list.add_argument("--challenge-project", "--challenge", "--project", metavar="SYNAPSE-ID", default=None)
     parser_list.add_argument("-s", "--status", default=None)
     parser_list.add_argument("--all", action="store_true", default=False)
+    parser_list.add_argument("--local", help="Answer from the local state index without calling Synapse", action="store_true", default=False)
     parser_list.set_defaults(func=command_list)
 
     parser_status = subparsers.add_parser('status', help="Check the status of a submission")
     parser_status.add_argument("submission")
+    parser_status.add_argument("--local", help="Answer from the local state index without calling Synapse", action="store_true", default=False)
     parser_status.set_defaults(func=command_check_status)
 
     parser_reset = subparsers.add_parser('reset', help="Reset a submission to RECEIVED for re-scoring (or set to some other status)")
@@ -664,15 +1185,33 @@ def main():
     parser_validate = subparsers.add_parser('validate', help="Validate all RECEIVED submissions to an evaluation")
     parser_validate.add_argument("evaluation", metavar="EVALUATION-ID", nargs='?', default=None, )
     parser_validate.add_argument("--all", action="store_true", default=False)
+    parser_validate.add_argument("--workers", help="Validate this many submissions at a time in worker processes", type=int, default=1)
     parser_validate.set_defaults(func=command_validate)
 
     parser_score = subparsers.add_parser('score', help="Score all VALIDATED submissions to an evaluation")
     parser_score.add_argument("evaluation", metavar="EVALUATION-ID", nargs='?', default=None)
     parser_score.add_argument("--all", action="store_true", default=False)
+    parser_score.add_argument("--batch", help="Score all VALIDATED submissions to a queue together in one pass", action="store_true", default=False)
+    parser_score.add_argument("--workers", help="Score this many submissions at a time in worker processes (ignored with --batch)", type=int, default=1)
     parser_score.set_defaults(func=command_score)
 
+    parser_daemon = subparsers.add_parser('daemon', help="Keep validating and scoring all queues until stopped with SIGTERM")
+    parser_daemon.add_argument("--min-interval", help="Seconds between rounds while there are submissions", type=int, default=DAEMON_MIN_INTERVAL)
+    parser_daemon.add_argument("--max-interval", help="Longest wait in seconds between rounds while idle", type=int, default=DAEMON_MAX_INTERVAL)
+    parser_daemon.add_argument("--batch", help="Score the submissions to a queue together in one pass", action="store_true", default=False)
+    parser_daemon.add_argument("--workers", help="Validate and score this many submissions at a time in worker processes", type=int, default=1)
+    parser_daemon.set_defaults(func=command_daemon)
+
+    parser_invalidate = subparsers.add_parser('invalidate-scores', help="Drop cached scores so the submissions are scored again")
+    parser_invalidate.add_argument("evaluation", metavar="EVALUATION-ID", nargs='?', default=None, help="Drop scores against the current gold standard of this evaluation")
+    parser_invalidate.add_argument("--md5", help="Drop scores of the submission file with this MD5", default=None)
+    parser_invalidate.add_argument("--all", action="store_true", default=False)
+    parser_invalidate.set_defaults(func=command_invalidate_scores)
+
     parser_rank = subparsers.add_parser('rank', help="Rank all SCORED submissions to an evaluation")
     parser_rank.add_argument("evaluation", metavar="EVALUATION-ID", default=None)
+    parser_rank.add_argument("--incremental", help="Rank only the submissions whose scores changed since the last run, updating ranks that moved", action="store_true", default=False)
+    parser_rank.add_argument("--local", help="Rank from the local leaderboard mirror instead of the leaderboard table", action="store_true", default=False)
     parser_rank.set_defaults(func=command_rank)
 
     parser_archive = subparsers.add_parser('archive', help="Archive submissions to a challenge")
@@ -685,6 +1224,8 @@ def main():
     parser_leaderboard = subparsers.add_parser('leaderboard', help="Print the leaderboard for an evaluation")
     parser_leaderboard.add_argument("evaluation", metavar="EVALUATION-ID", default=None)
     parser_leaderboard.add_argument("--out", default=None)
+    parser_leaderboard.add_argument("--local", help="Print the local leaderboard mirror without calling Synapse", action="store_true", default=False)
+    parser_leaderboard.add_argument("--sync", help="Update the local leaderboard mirror from the SCORED submissions, then print it", action="store_true", default=False)
     parser_leaderboard.set_defaults(func=command_leaderboard)
 
     args = parser.parse_args()
@@ -692,14 +1233,10 @@ def main():
     print "\n" * 2, "=" * 75
     print datetime.utcnow().isoformat()
 
-    ## Acquire lock, don't run two scoring scripts at once
-    try:
-        update_lock = lock.acquire_lock_or_fail('challenge', max_age=timedelta(hours=4))
-    except lock.LockedException:
-        print u"Is the scoring script already running? Can't acquire lock."
-        # can't acquire lock, so return error code 75 which is a
-        # temporary error according to /usr/include/sysexits.h
-        return 75
+    ## Each stage of each queue is locked while it runs, see stage_locked,
+    ## so scripts working on different queues don't wait for each other
+    lock_timeout = args.lock_timeout
+    sandboxed = args.sandbox
 
     try:
         syn = synapseclient.Synapse(debug=args.debug)
@@ -715,9 +1252,20 @@ def main():
         messages.send_messages = args.send_messages
         messages.send_notifications = args.notifications
         messages.acknowledge_receipt = args.acknowledge_receipt
+        messages.start_dispatcher()
+
+        lookups = lookup_cache.LookupCache(lookup_cache.cache_path)
+        states = state_index.StateIndex(state_index.index_path)
+        mirror = leaderboard_mirror.LeaderboardMirror(leaderboard_mirror.mirror_path)
 
         args.func(args)
 
+    except lock.LockedException as ex1:
+        print u"Is the scoring script already running? %s" % ex1
+        # can't acquire lock, so return error code 75 which is a
+        # temporary error according to /usr/include/sysexits.h
+        return 75
+
     except Exception as ex1:
         sys.stderr.write('Error in scoring script:\n')
         st = StringIO()
@@ -729,7 +1277,13 @@ def main():
             messages.error_notification(userIds=conf.ADMIN_USER_IDS, message=st.getvalue(), queue_name=conf.CHALLENGE_NAME)
 
     finally:
-        update_lock.release()
+        messages.stop_dispatcher()
+        if lookups is not None:
+            lookups.close()
+        if states is not None:
+            states.close()
+        if mirror is not None:
+            mirror.close()
 
     print "\ndone: ", datetime.utcnow().isoformat()
     print "=" * 75, "\n" * 2
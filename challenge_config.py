@@ -3,14 +3,21 @@
 ## challenge specific code and configuration
 ##
 ##-----------------------------------------------------------------------------
+import hashlib
 import os
+import sys
 import pandas as pd
 import numpy as np
 import sklearn
-import decimal
 from sklearn.metrics import auc
-from multiprocessing import Pool
 from synapseclient import Column
+import scoring
+import permutation
+import gold_store
+import score_cache
+import submission_cache
+import stream_validation
+import bootstrap
 ## A Synapse project will hold the assetts for your challenge. Put its
 ## synapse ID here, for example
 ## CHALLENGE_SYN_ID = "syn1234567"
@@ -27,15 +34,93 @@ ADMIN_USER_IDS = ["3324230"]
 ##Challenge validation / scoring ###
 challenge = {'challenge1':'SHEDDING_SC1','challenge2':'SYMPTOMATIC_SC2','challenge3':'LOGSYMPTSCORE_SC3'}
 
-def validate(submission, goldstandard, key):
-    goldstandard = pd.read_csv(goldstandard)
+SCORED_MESSAGE = "Thank you for your submission. Your submission has been validated and scored. Stay tuned for results on the challenge site at the end of each challenge phase."
+
+## AUROC/AUPR engine used by score_1_2: 'vectorized' (see scoring.py) or
+## 'legacy' for the block by block getAUROC_PR below
+AUC_ENGINE = 'vectorized'
+
+## permutation testing of the submitted scores (see permutation.py)
+PERMUTE_TIMES = 10000
+## fixed seed so rescoring a submission reproduces its p-values
+PERMUTATION_SEED = 2016
+## size of the process pool, None uses every core and 1 stays in process
+PERMUTATION_PROCESSES = None
+## the correlation permutations of score_3 are cheap enough to stay in process
+CORRELATION_PERMUTATION_PROCESSES = 1
+## p-values below this threshold are flagged as significant
+PVALUE_THRESHOLD = 0.05
+## queues run the full PERMUTE_TIMES permutations unless their entry in
+## config_evaluations opts in with 'pvalue_method':'analytic'. They then
+## report the Mann-Whitney (AUROC) or Fisher-z (correlation) p-value
+## unless it falls inside this band around the threshold, where
+## permutation testing decides, and stop the AUPR permutations early
+ANALYTIC_PVALUE_BAND = (0.01, 0.2)
+
+## bootstrap confidence intervals of the scores (see bootstrap.py), cut
+## short after BOOTSTRAP_TIME_BUDGET seconds per submission
+BOOTSTRAP_TIMES = 1000
+BOOTSTRAP_CONFIDENCE = 0.95
+BOOTSTRAP_TIME_BUDGET = 60
+
+## submissions over these limits are rejected by validate_streaming
+## without reading the rest of the file
+MAX_SUBMISSION_BYTES = 100 * 2**20
+MAX_SUBMISSION_ROWS = 1000000
+
+## limits of each validation or scoring call run with --sandbox (see
+## sandbox.py), None for no limit. A submission over a limit is INVALID.
+SANDBOX_CPU_SECONDS = 600
+SANDBOX_WALL_SECONDS = 900
+SANDBOX_MAX_RSS = 4 * 2**30
+
+BOM_SUBJECTID = '\xef\xbb\xbfSUBJECTID'
+
+## bump when a change to the scoring code changes its results, so scores
+## cached by the old code (see score_cache.py) aren't reused
+SCORING_VERSION = 1
+
+def read_submission(submission):
+    """
+    Reads a submission file keeping SUBJECTIDs as strings, to match the
+    SUBJECTID index of the gold standard store
+    """
+    submission = pd.read_csv(submission, dtype={'SUBJECTID':str, BOM_SUBJECTID:str})
+    #FIX BYTE CASE
+    if submission.columns.values[0] == BOM_SUBJECTID:
+        submission.columns.values[0] = 'SUBJECTID'
+    return(submission)
+
+def aligned_predictions(submission, goldstandard, key, cache_key=None):
+    """
+    The submitted values for key in gold standard order, NaN for subjects
+    without a value. The submission file is only parsed when validation
+    didn't leave a parsed copy under cache_key.
+    """
+    predict = submission_cache.load(cache_key, goldstandard) if cache_key else None
+    if predict is None:
+        submission = read_submission(submission)
+        predict = goldstandard.align(submission['SUBJECTID'].values, submission[challenge[key]].values)
+    return(predict)
+
+def align_submission(submission, goldstandard, key, cache_key=None):
+    """
+    Lines up the submitted values with the gold standard values for key,
+    dropping subjects where either one is missing
+
+    :returns: (predict, truth) arrays in gold standard order
+    """
+    predict = aligned_predictions(submission, goldstandard, key, cache_key)
+    truth = goldstandard.values[challenge[key]]
+    keep = ~(np.isnan(predict) | np.isnan(truth))
+    return(predict[keep], truth[keep])
+
+def validate(submission, goldstandard, key, cache_key=None):
+    goldstandard = gold_store.get(goldstandard)
     try:
-        submission = pd.read_csv(submission)
+        submission = read_submission(submission)
     except Exception as e:
         raise AssertionError("Submitted file must be a comma-delimited file")
-    #FIX BYTE CASE
-    if submission.columns.values[0] == '\xef\xbb\xbfSUBJECTID':
-        submission.columns.values[0] = 'SUBJECTID'
 
     #CHECK: SUBJECTID must exist
     assert 'SUBJECTID' in submission, 'SUBJECTID must be one of the column headers\nYour column headers= %s' % ','.join(list(submission.columns))
@@ -53,15 +138,50 @@ def validate(submission, goldstandard, key):
     assert all(~submission.duplicated('SUBJECTID')), 'No duplicate SUBJECTID allowed.\nDuplicated values=%s' % ','.join(submission[submission.duplicated('SUBJECTID')]['SUBJECTID'])
 
     #CHECK: Must contain SUBJECTIDs that exist in the template
-    assert all(submission['SUBJECTID'].isin(goldstandard['SUBJECTID'])), 'All SUBJECTIDs in your prediction file must also be in the template.\n%s not part of template SUBJECTIDs' % ','.join(submission[~submission['SUBJECTID'].isin(goldstandard['SUBJECTID'])]['SUBJECTID'])
+    positions = goldstandard.positions(submission['SUBJECTID'].values)
+    assert all(positions >= 0), 'All SUBJECTIDs in your prediction file must also be in the template.\n%s not part of template SUBJECTIDs' % ','.join(submission['SUBJECTID'].values[positions < 0])
 
     #CHECK: Must contain all SUBJECTIDs
-    assert all(goldstandard['SUBJECTID'].isin(submission['SUBJECTID'])), "You have missing SUBJECTIDs.\nYou are missing %s" % ','.join(goldstandard['SUBJECTID'][~goldstandard['SUBJECTID'].isin(submission['SUBJECTID'])])
+    missing = goldstandard.missing(positions)
+    assert len(missing) == 0, "You have missing SUBJECTIDs.\nYou are missing %s" % ','.join(missing)
 
     #CHECK: submissions must be all NA
     assert submission[challenge[key]].dtype == 'float64' or submission[challenge[key]].dtype == 'int64','Submissions must be numerical values'
+
+    #keep the parsed values for scoring
+    if cache_key:
+        submission_cache.store(cache_key, goldstandard, goldstandard.align(submission['SUBJECTID'].values, submission[challenge[key]].values, positions))
     return(True)
 
+def validate_streaming(submission, goldstandard, key, cache_key=None):
+    """
+    Same checks as validate, made in a single pass over chunks of the file.
+    Reports every problem found instead of stopping at the first one.
+    """
+    goldstandard = gold_store.get(goldstandard)
+    problems, predict = stream_validation.validate_stream(submission, goldstandard, challenge[key], key,
+                                                          max_bytes=MAX_SUBMISSION_BYTES,
+                                                          max_rows=MAX_SUBMISSION_ROWS)
+    assert not problems, '\n\n'.join(problems)
+
+    #keep the parsed values for scoring
+    if cache_key:
+        submission_cache.store(cache_key, goldstandard, predict)
+    return(True)
+
+def pvalue_method(key):
+    """
+    'analytic' or 'permutation', as configured for the queue of key
+    """
+    return config_evaluations_by_key[key].get('pvalue_method', 'permutation')
+
+def near_threshold(pVal):
+    """
+    True if an analytic p-value is too close to PVALUE_THRESHOLD (or
+    undefined) to be trusted on its own
+    """
+    return not (pVal < ANALYTIC_PVALUE_BAND[0] or pVal > ANALYTIC_PVALUE_BAND[1])
+
 #SCORE 1,2 HELPER FUNCTIONS
 def __nonlinear_interpolated_evalStats(block_df, blockWise_stats):
     """
@@ -176,71 +296,164 @@ def getAUROC_PR(sub_stats):
     return(roc_auc,PR_auc)
 
 
-def score_1_2(submission, goldstandard, key):
-    goldstandard = pd.read_csv(goldstandard)
-    submission = pd.read_csv(submission)
-    submission['pred'] = submission[challenge[key]]
-    goldstandard['truth'] = goldstandard[challenge[key]]
+def score_1_2(submission, goldstandard, key, cache_key=None):
+    goldstandard = gold_store.get(goldstandard)
+    predict, truth = align_submission(submission, goldstandard, key, cache_key)
 
-    if submission.columns.values[0] == '\xef\xbb\xbfSUBJECTID':
-        submission.columns.values[0] = 'SUBJECTID'
-    #submission = submission.sort('SUBJECTID')
-    #goldstandard = goldstandard.sort('SUBJECTID')
-    data = submission.merge(goldstandard, left_on="SUBJECTID", right_on="SUBJECTID", how="outer")
-    #remove rows with null truth values
-    data = data[~data['truth'].isnull()]
-    sub_stats = pd.DataFrame.from_dict({'predict':data['pred'], 'truth':data['truth']}, dtype='float64')
-
-    sub_stats = sub_stats.sort_values(['predict'],ascending=False)
-    true_auroc, true_aupr = getAUROC_PR(sub_stats)
-    # shuffled = dict()
-    # permute_times = 10000
-    # for i in xrange(permute_times):
-    #    np.random.shuffle(sub_stats['predict'].values)
-    #    sub_stats = sub_stats.reset_index()
-    #    del sub_stats['index']
-    #    shuffled[i] = sub_stats
-
-    # mp = Pool(2)
-    # temp = mp.map(getAUROC_PR,shuffled.values())
-    # auroc_total = []
-    # aupr_total = []
-    # for auc, pr in temp:
-    #    auroc_total.append(auc)
-    #    aupr_total.append(pr)
-
-    # pVal_ROC = decimal.Decimal(sum(auroc_total >= np.float64(true_auroc))) / decimal.Decimal(permute_times+1)
-    # pVal_PR = decimal.Decimal(sum(aupr_total >= np.float64(true_aupr))) / decimal.Decimal(permute_times+1)
+    if AUC_ENGINE == 'legacy':
+        sub_stats = pd.DataFrame.from_dict({'predict':predict, 'truth':truth}, dtype='float64')
+        sub_stats = sub_stats.sort_values(['predict'],ascending=False)
+        true_auroc, true_aupr = getAUROC_PR(sub_stats)
+        analytic_ROC = np.nan
+    else:
+        true_auroc, true_aupr, analytic_ROC = scoring.auroc_aupr_pvalue(predict, truth)
+    return auc_results(predict, truth, key, true_auroc, true_aupr, analytic_ROC)
+
+def auc_results(predict, truth, key, true_auroc, true_aupr, analytic_ROC):
+    """
+    Adds the p-values and confidence intervals to an AUROC/AUPR score
+
+    :returns: (score, message) as returned by score_1_2
+    """
+    if pvalue_method(key) == 'analytic':
+        #there is no analytic null for the AUPR, its permutations stop as
+        #soon as the p-value is clearly on one side of the threshold
+        roc_undecided = near_threshold(analytic_ROC)
+        pVal_ROC, pVal_PR = permutation.auc_pvalues(predict, truth,
+                                                    permute_times=PERMUTE_TIMES, seed=PERMUTATION_SEED,
+                                                    processes=PERMUTATION_PROCESSES,
+                                                    threshold=PVALUE_THRESHOLD, watch=(roc_undecided, True))
+        if not roc_undecided:
+            pVal_ROC = analytic_ROC
+    else:
+        pVal_ROC, pVal_PR = permutation.auc_pvalues(predict, truth,
+                                                    permute_times=PERMUTE_TIMES, seed=PERMUTATION_SEED,
+                                                    processes=PERMUTATION_PROCESSES)
+
+    (AUROC_low, AUROC_high), (AUPR_low, AUPR_high) = bootstrap.auc_intervals(predict, truth,
+                                                   times=BOOTSTRAP_TIMES, confidence=BOOTSTRAP_CONFIDENCE,
+                                                   seed=PERMUTATION_SEED, processes=PERMUTATION_PROCESSES,
+                                                   time_budget=BOOTSTRAP_TIME_BUDGET)
 
     return(dict(AUROC = round(true_auroc,4), AUPR = round(true_aupr,4), 
-            #nAUROC_pVal = "{:.2e}".format(pVal_ROC), 
-            nAUROC_pVal = '-1',
-            #nAUPR_pVal="{:.2e}".format(pVal_PR),
-            nAUPR_pVal = '-1', 
-            AUPRpVal_boolean= "NA", AUROCpVal_boolean="NA", finalRank=0),
-            "Thank you for your submission. Your submission has been validated and scored. Stay tuned for results on the challenge site at the end of each challenge phase.")
-
-def score_3(submission, goldstandard, key):
-    goldstandard = pd.read_csv(goldstandard)
-    submission = pd.read_csv(submission)
-    submission = submission.sort_values('SUBJECTID')
-    goldstandard = goldstandard.sort_values('SUBJECTID')
-    score = np.corrcoef(submission[challenge[key]],goldstandard[challenge[key]])[0, 1]
-
-    # total = []
-    # permute_times = 10000
-    # for i in xrange(permute_times):
-    #    np.random.shuffle(submission[challenge[key]].values)
-    #    temp = np.corrcoef(submission[challenge[key]],goldstandard[challenge[key]])[0, 1]
-    #    total.append(temp)
-
-    # pVal = decimal.Decimal(sum(total >= score)) / decimal.Decimal(permute_times+1)
+            AUROC_CI_low = round(AUROC_low,4), AUROC_CI_high = round(AUROC_high,4),
+            AUPR_CI_low = round(AUPR_low,4), AUPR_CI_high = round(AUPR_high,4),
+            nAUROC_pVal = "{:.2e}".format(pVal_ROC),
+            nAUPR_pVal = "{:.2e}".format(pVal_PR),
+            AUPRpVal_boolean = str(pVal_PR < PVALUE_THRESHOLD),
+            AUROCpVal_boolean = str(pVal_ROC < PVALUE_THRESHOLD), finalRank=0),
+            SCORED_MESSAGE)
+
+def score_1_2_batch(submissions, goldstandard, key, cache_keys):
+    """
+    Scores many submissions to an SC1/SC2 queue at once. The submissions
+    are aligned into a matrix with one row per submission, which is sorted
+    row by row and run through the AUROC/AUPR kernel in one pass.
+
+    :returns: see score_batch
+    """
+    if AUC_ENGINE == 'legacy':
+        return [capture(score_1_2, submission, goldstandard, key, cache_key)
+                for submission, cache_key in zip(submissions, cache_keys)]
+    goldstandard = gold_store.get(goldstandard)
+    def score_rows(predict, truth):
+        auroc, aupr, analytic_ROC = scoring.batch_auroc_aupr_pvalue(predict, truth)
+        return [(row, (auroc[i], aupr[i], analytic_ROC[i])) for i, row in enumerate(predict)]
+    return score_batch(submissions, goldstandard, key, cache_keys, score_rows, auc_results)
+
+def score_3(submission, goldstandard, key, cache_key=None):
+    goldstandard = gold_store.get(goldstandard)
+    predict, truth = align_submission(submission, goldstandard, key, cache_key)
+    score = scoring.pearson(predict, truth)
+    return correlation_results(predict, truth, key, score)
+
+def correlation_results(predict, truth, key, score):
+    """
+    Adds the p-value and confidence interval to a correlation score
+
+    :returns: (score, message) as returned by score_3
+    """
+    if pvalue_method(key) == 'analytic':
+        pVal = scoring.correlation_analytic_pvalue(score, len(predict))
+        if near_threshold(pVal):
+            pVal = permutation.correlation_pvalue(predict, truth,
+                                                  permute_times=PERMUTE_TIMES, seed=PERMUTATION_SEED,
+                                                  processes=CORRELATION_PERMUTATION_PROCESSES,
+                                                  threshold=PVALUE_THRESHOLD)
+    else:
+        pVal = permutation.correlation_pvalue(predict, truth,
+                                              permute_times=PERMUTE_TIMES, seed=PERMUTATION_SEED,
+                                              processes=CORRELATION_PERMUTATION_PROCESSES)
+
+    score_low, score_high = bootstrap.correlation_interval(predict, truth,
+                                                           times=BOOTSTRAP_TIMES, confidence=BOOTSTRAP_CONFIDENCE,
+                                                           seed=PERMUTATION_SEED, processes=CORRELATION_PERMUTATION_PROCESSES,
+                                                           time_budget=BOOTSTRAP_TIME_BUDGET)
 
     return (dict(score=round(score,4), 
-                #pVal = "{:.2e}".format(pVal), 
-                pVal = '-1',
-                booleanpVal="NA", finalRank=0),
-            "Thank you for your submission. Your submission has been validated and scored. Stay tuned for results on the challenge site at the end of each challenge phase.")
+                score_CI_low = round(score_low,4), score_CI_high = round(score_high,4),
+                pVal = "{:.2e}".format(pVal),
+                booleanpVal = str(pVal < PVALUE_THRESHOLD), finalRank=0),
+            SCORED_MESSAGE)
+
+def score_3_batch(submissions, goldstandard, key, cache_keys):
+    """
+    Scores many submissions to the SC3 queue at once, computing every
+    correlation with one operation over the submission matrix
+
+    :returns: see score_batch
+    """
+    goldstandard = gold_store.get(goldstandard)
+    def score_rows(predict, truth):
+        scores = scoring.pearson(predict, truth)
+        return [(row, (scores[i],)) for i, row in enumerate(predict)]
+    return score_batch(submissions, goldstandard, key, cache_keys, score_rows, correlation_results)
+
+def capture(func, *args):
+    """
+    :returns: (func(*args), None), or (None, exc_info) if it raised
+    """
+    try:
+        return (func(*args), None)
+    except Exception:
+        return (None, sys.exc_info())
+
+def score_batch(submissions, goldstandard, key, cache_keys, score_rows, results_func):
+    """
+    Aligns every submission to the gold standard into one matrix, scores all
+    of its rows with score_rows and finishes each row with results_func.
+    Submissions missing values for some subjects are scored on their own.
+
+    :returns: one (result, exc_info) pair per submission, where result is
+              what the single submission scoring function would return and
+              exc_info is set instead if the submission couldn't be scored
+    """
+    results = [None] * len(submissions)
+    aligned = {}
+    truth = goldstandard.values[challenge[key]]
+    scored = ~np.isnan(truth)
+    def finish(predict, truth):
+        #predict holds one row per submission
+        rows, exc_info = capture(score_rows, predict, truth)
+        if exc_info:
+            return [(None, exc_info)] * len(predict)
+        return [capture(results_func, row, truth, key, *row_scores) for row, row_scores in rows]
+
+    for i, (submission, cache_key) in enumerate(zip(submissions, cache_keys)):
+        predict, exc_info = capture(aligned_predictions, submission, goldstandard, key, cache_key)
+        if exc_info:
+            results[i] = (None, exc_info)
+        elif np.isnan(predict[scored]).any():
+            keep = scored & ~np.isnan(predict)
+            results[i] = finish(predict[None, keep], truth[keep])[0]
+        else:
+            aligned[i] = predict[scored]
+
+    if aligned:
+        rows = sorted(aligned)
+        for i, result in zip(rows, finish(np.vstack([aligned[i] for i in rows]), truth[scored])):
+            results[i] = result
+    return results
 
 
 # evaluation_queues = [
@@ -283,12 +496,24 @@ leaderboard_columns[7991328] = LEADERBOARD_COLUMNS + [
     Column(name='AUPR',         display_name='AUPR',   columnType='DOUBLE'),
     Column(name='AUROC',          display_name='AUROC',    columnType='DOUBLE'),
     Column(name='nAUPR_pVal',           display_name='nAUPR_pVal',     columnType='DOUBLE'),
-    Column(name='nAUROC_pVal',           display_name='nAUROC_pVal',     columnType='DOUBLE')]
+    Column(name='nAUROC_pVal',           display_name='nAUROC_pVal',     columnType='DOUBLE'),
+    Column(name='AUPR_CI_low',          display_name='AUPR CI low',    columnType='DOUBLE'),
+    Column(name='AUPR_CI_high',         display_name='AUPR CI high',   columnType='DOUBLE'),
+    Column(name='AUROC_CI_low',         display_name='AUROC CI low',   columnType='DOUBLE'),
+    Column(name='AUROC_CI_high',        display_name='AUROC CI high',  columnType='DOUBLE')]
 
 leaderboard_columns[7991330] = leaderboard_columns[7991328]
 leaderboard_columns[7991332] = LEADERBOARD_COLUMNS + [
     Column(name='score',         display_name='Correlation',   columnType='DOUBLE'),
-    Column(name='pVal',          display_name='pVal',    columnType='DOUBLE')]
+    Column(name='pVal',          display_name='pVal',    columnType='DOUBLE'),
+    Column(name='score_CI_low',  display_name='Correlation CI low',    columnType='DOUBLE'),
+    Column(name='score_CI_high', display_name='Correlation CI high',   columnType='DOUBLE')]
+
+## what rank --incremental ranks each question by (see rank_index.py), as
+## (annotation, ascending) pairs, in the same way as ranking.py does
+SC1_2_RANK_METRICS = [('AUPR', False), ('AUROC', False)]
+SC3_RANK_METRICS = [('score', False)]
+
 ## map each evaluation queues to the synapse ID of a table object
 ## where the table holds a leaderboard for that question
 leaderboard_tables = {}
@@ -299,9 +524,11 @@ config_evaluations = [
     {
         #'id':5821575,
         'id':7991328,
-        'validation_function': validate,
+        'validation_function': validate_streaming,
         'scoring_function': score_1_2,
+        'batch_scoring_function': score_1_2_batch,
         'key': 'challenge1',
+        'rank_metrics': SC1_2_RANK_METRICS,
         'leaderboard':os.path.join("goldstandards",'IDResilienceChallenge_GoldStandard_SHEDDING_SC1.csv'),
         'test':os.path.join("goldstandards",'IDResilienceChallenge_GoldStandard_test_SHEDDING_SC1.csv')
 
@@ -310,9 +537,11 @@ config_evaluations = [
     {
         #'id':5821583,
         'id':7991330,
-        'validation_function': validate,
+        'validation_function': validate_streaming,
         'scoring_function': score_1_2,
+        'batch_scoring_function': score_1_2_batch,
         'key': 'challenge2',
+        'rank_metrics': SC1_2_RANK_METRICS,
         'leaderboard':os.path.join("goldstandards",'IDResilienceChallenge_GoldStandard_SYMPTOMATIC_SC2.csv'),
         'test':os.path.join("goldstandards",'IDResilienceChallenge_GoldStandard_test_SYMPTOMATIC_SC2.csv')
 
@@ -322,9 +551,11 @@ config_evaluations = [
     {
         #'id':5821621,
         'id':7991332,
-        'validation_function': validate,
+        'validation_function': validate_streaming,
         'scoring_function': score_3,
+        'batch_scoring_function': score_3_batch,
         'key': 'challenge3',
+        'rank_metrics': SC3_RANK_METRICS,
         'leaderboard':os.path.join("goldstandards",'IDResilienceChallenge_GoldStandard_LOGSYMPTSCORE_SC3.csv'),
         'test':os.path.join("goldstandards",'IDResilienceChallenge_GoldStandard_test_LOGSYMPTSCORE_SC3.csv')
 
@@ -333,6 +564,7 @@ config_evaluations = [
 
 ]
 config_evaluations_map = {ev['id']:ev for ev in config_evaluations}
+config_evaluations_by_key = {ev['key']:ev for ev in config_evaluations}
 
 
 def validate_submission(evaluation, submission):
@@ -350,7 +582,8 @@ def validate_submission(evaluation, submission):
     #         'challenge3':os.path.join(template_location,'IDResilienceChallenge_SubmissionTemplate_LOGSYMPTSCORE_SC3.csv')}
 
 
-    results = validation_func(submission.filePath,config['test'],config['key'])
+    cache_key = submission_cache.cache_key(submission.id, submission.filePath)
+    results = validation_func(submission.filePath,config['test'],config['key'],cache_key)
 
     return results, "Looks OK to me!"
 
@@ -370,8 +603,100 @@ def score_submission(evaluation, submission):
     #         'challenge2':os.path.join(template_location,'IDResilienceChallenge_GoldStandard_SYMPTOMATIC_SC2.csv'),
     #         'challenge3':os.path.join(template_location,'IDResilienceChallenge_GoldStandard_LOGSYMPTSCORE_SC3.csv')}
 
-    results = score_func(submission.filePath,config['test'],config['key'])
+    md5 = submission_cache.file_md5(submission.filePath)
+    score_key = score_cache.cache_key(md5, gold_store.get(config['test']).md5, scoring_version(config))
+    cache_key = submission_cache.cache_key(submission.id, submission.filePath, md5)
+    results = score_cache.load(score_key)
+    if results is None:
+        results = score_func(submission.filePath,config['test'],config['key'],cache_key)
+        score_cache.store(score_key, results)
+    submission_cache.discard(cache_key)
 
     return results
 
 
+def score_submissions(evaluation, submissions):
+    """
+    Score many submissions to one queue with its batch scoring function.
+    Submissions with a cached score aren't scored again.
+
+    :returns: one (result, exc_info) pair per submission, where result is
+              (score, message) as returned by score_submission and exc_info
+              is set instead if the submission couldn't be scored
+    """
+    config = config_evaluations_map[int(evaluation.id)]
+    batch_func = config['batch_scoring_function']
+    gold_md5 = gold_store.get(config['test']).md5
+    version = scoring_version(config)
+
+    results = [None] * len(submissions)
+    missed = []
+    for i, submission in enumerate(submissions):
+        md5, exc_info = capture(submission_cache.file_md5, submission.filePath)
+        if exc_info:
+            results[i] = (None, exc_info)
+            continue
+        score_key = score_cache.cache_key(md5, gold_md5, version)
+        cache_key = submission_cache.cache_key(submission.id, submission.filePath, md5)
+        cached = score_cache.load(score_key)
+        if cached is not None:
+            results[i] = (cached, None)
+            submission_cache.discard(cache_key)
+        else:
+            missed.append((i, score_key, cache_key))
+
+    if missed:
+        positions, _, cache_keys = zip(*missed)
+        scored = batch_func([submissions[position].filePath for position in positions], config['test'],
+                            config['key'], list(cache_keys))
+        for (i, score_key, cache_key), (result, exc_info) in zip(missed, scored):
+            results[i] = (result, exc_info)
+            if result:
+                score_cache.store(score_key, result)
+                submission_cache.discard(cache_key)
+
+    return results
+
+
+def scoring_version(config):
+    """
+    Identifies everything a queue's scores depend on besides the submission
+    and gold standard files: the scoring code and the settings it runs with
+    """
+    settings = (SCORING_VERSION, config['scoring_function'].__name__, config['key'],
+                config.get('pvalue_method'), AUC_ENGINE, PERMUTE_TIMES, PERMUTATION_SEED,
+                PVALUE_THRESHOLD, ANALYTIC_PVALUE_BAND, BOOTSTRAP_TIMES, BOOTSTRAP_CONFIDENCE)
+    return hashlib.md5(repr(settings)).hexdigest()
+
+
+def invalidate_scores(evaluation=None, md5=None):
+    """
+    Drops cached scores of a submission file MD5, of scores against the
+    current gold standard of an evaluation, or all of them
+
+    :returns: how many cached scores were removed
+    """
+    goldstandard_md5 = None
+    if evaluation is not None:
+        goldstandard_md5 = gold_store.get(config_evaluations_map[int(evaluation)]['test']).md5
+    return score_cache.invalidate(submission_md5=md5, goldstandard_md5=goldstandard_md5)
+
+
+def use_single_process():
+    """
+    Runs permutation tests in the calling process, for the workers of a
+    process pool, which can't start pools of their own
+    """
+    global PERMUTATION_PROCESSES, CORRELATION_PERMUTATION_PROCESSES
+    PERMUTATION_PROCESSES = 1
+    CORRELATION_PERMUTATION_PROCESSES = 1
+
+
+def preload_goldstandards():
+    """
+    Parse every configured gold standard once, up front, so validation and
+    scoring only do lookups
+    """
+    gold_store.preload(config_evaluations)
+
+
@@ -1,5 +1,11 @@
 # Automation of validation and scoring
 # Make sure you point to the directory where challenge.py belongs and a log directory must exist for the output
+#
+# Instead of running this every 10 minutes, the daemon subcommand validates
+# and scores continuously from a single process, stopping on SIGTERM:
+#   python challenge.py -u DARPA --send-messages --notifications daemon >> log/score.log 2>&1
+# Each queue is locked only while it is validated or scored, so runs of this
+# script skip the queue the daemon is busy with and handle the others.
 cd ~/DARPA_Challenge
 #---------------------
 #Validate submissions
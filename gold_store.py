@@ -0,0 +1,105 @@
+##-----------------------------------------------------------------------------
+##
+## in-process store of parsed gold standard files
+##
+##-----------------------------------------------------------------------------
+import hashlib
+import os
+import numpy as np
+import pandas as pd
+
+
+class GoldStandard(object):
+    """
+    A gold standard file parsed once into numeric arrays, along with a
+    SUBJECTID -> position index for aligning submissions to it
+    """
+
+    def __init__(self, path):
+        self.path = path
+        stat = os.stat(path)
+        self.mtime = stat.st_mtime
+        self.file_size = stat.st_size
+        with open(path, 'rb') as f:
+            ## identifies the file contents that scores were computed against
+            self.md5 = hashlib.md5(f.read()).hexdigest()
+
+        df = pd.read_csv(path, dtype={'SUBJECTID': str})
+        self.subject_ids = df['SUBJECTID'].values
+        self.size = len(self.subject_ids)
+        self.index = {subject_id: i for i, subject_id in enumerate(self.subject_ids)}
+        ## identifies the SUBJECTID layout that aligned arrays refer to
+        self.digest = hashlib.md5('\n'.join(self.subject_ids)).hexdigest()
+        self.values = {}
+        for column in df.columns:
+            if column != 'SUBJECTID' and df[column].dtype.kind in 'biuf':
+                self.values[column] = np.ascontiguousarray(df[column].values, dtype='float64')
+
+    def is_current(self):
+        """True if the file hasn't changed since it was parsed"""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False
+        return stat.st_mtime == self.mtime and stat.st_size == self.file_size
+
+    def positions(self, subject_ids):
+        """
+        Position of each SUBJECTID in the gold standard, -1 for SUBJECTIDs
+        that aren't part of it
+        """
+        get = self.index.get
+        return np.fromiter((get(subject_id, -1) for subject_id in subject_ids), dtype='int64', count=len(subject_ids))
+
+    def missing(self, positions):
+        """
+        SUBJECTIDs of the gold standard, in file order, not covered by positions
+        """
+        seen = np.zeros(self.size, dtype=bool)
+        seen[positions[positions >= 0]] = True
+        return self.subject_ids[~seen]
+
+    def align(self, subject_ids, values, positions=None):
+        """
+        Lays submitted values out in gold standard order, NaN where the
+        submission has no value for a SUBJECTID
+        """
+        if positions is None:
+            positions = self.positions(subject_ids)
+        aligned = np.empty(self.size, dtype='float64')
+        aligned.fill(np.nan)
+        known = positions >= 0
+        aligned[positions[known]] = np.asarray(values, dtype='float64')[known]
+        return aligned
+
+
+## module level cache of parsed gold standards, keyed by path
+_gold_standards = {}
+
+
+def get(path):
+    """
+    The parsed gold standard at path, parsing it again if the file changed
+    since it was last loaded
+    """
+    path = os.path.abspath(path)
+    gold = _gold_standards.get(path)
+    if gold is None or not gold.is_current():
+        gold = GoldStandard(path)
+        _gold_standards[path] = gold
+    return gold
+
+
+def preload(evaluations):
+    """
+    Parse the 'test' and 'leaderboard' gold standards of each evaluation
+    config that exist on disk
+    """
+    for config in evaluations:
+        for phase in ('test', 'leaderboard'):
+            if config.get(phase) and os.path.exists(config[phase]):
+                get(config[phase])
+
+
+def clear():
+    _gold_standards.clear()
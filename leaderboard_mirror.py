@@ -0,0 +1,142 @@
+##-----------------------------------------------------------------------------
+##
+## local SQLite mirror of the leaderboard of each evaluation queue
+##
+##-----------------------------------------------------------------------------
+import os
+import pandas as pd
+import sqlite3
+import time
+from synapseclient.table import to_boolean
+import leaderboard_sync
+
+## default location of the mirror, shared by every run
+mirror_path = os.path.join(os.getcwd(), 'leaderboard_mirror.db')
+
+## SQLite storage of each Synapse column type, text for the rest
+SQL_TYPES = {'DOUBLE': 'real', 'INTEGER': 'integer', 'BOOLEAN': 'integer'}
+
+
+def _quote(name):
+    return '"%s"' % name.replace('"', '""')
+
+
+def _value(value, column):
+    """
+    A value in the storage type of its column, like the p-values scored as
+    formatted strings, or as it is if it doesn't convert
+    """
+    if value is None or value == '':
+        return None
+    column_type = column.get('columnType')
+    try:
+        if column_type == 'DOUBLE':
+            return float(value)
+        elif column_type == 'INTEGER':
+            return int(value)
+        elif column_type == 'BOOLEAN':
+            return int(to_boolean(value) if isinstance(value, basestring) else bool(value))
+    except (TypeError, ValueError):
+        pass
+    return value
+
+
+class LeaderboardMirror(object):
+    """
+    One table per evaluation queue holding its leaderboard columns, the
+    status etag each row was built from and when it was synced. Rows are
+    kept up to date by sync, which only rebuilds the rows of statuses that
+    changed, and by upsert as submissions are scored. Reads select just
+    the columns they need.
+    """
+
+    def __init__(self, path=None):
+        self.db = sqlite3.connect(path or ':memory:')
+        self.db.execute("pragma journal_mode=wal")
+        self.db.execute("pragma synchronous=normal")
+        self._columns = {}
+
+    def _table(self, evaluation_id, columns):
+        """
+        Name of the table of an evaluation, created or given any columns
+        it lacks
+        """
+        #callers pass IDs as int, str or unicode
+        evaluation_id = str(evaluation_id)
+        table = _quote('leaderboard_%s' % evaluation_id)
+        existing = self._columns.get(evaluation_id)
+        if existing is None:
+            self.db.execute("create table if not exists %s (objectId text primary key, _etag text, _synced_at real)" % table)
+            existing = self._columns[evaluation_id] = [row[1] for row in self.db.execute("pragma table_info(%s)" % table)]
+        for column in columns:
+            if column['name'] not in existing:
+                self.db.execute("alter table %s add column %s %s" % (
+                    table, _quote(column['name']), SQL_TYPES.get(column.get('columnType'), 'text')))
+                existing.append(column['name'])
+        return table
+
+    def _upsert(self, table, columns, fields, etag):
+        columns = [column for column in columns if column['name'] != 'objectId']
+        names = ['objectId', '_etag', '_synced_at'] + [column['name'] for column in columns]
+        values = [str(fields['objectId']), etag, time.time()] + [_value(fields.get(column['name']), column) for column in columns]
+        self.db.execute("insert or replace into %s (%s) values (%s)" % (
+            table, ", ".join(_quote(name) for name in names), ", ".join("?" * len(names))), values)
+
+    def upsert(self, evaluation_id, columns, submission, fields, etag=None):
+        """
+        Stores the row of a submission, as built by leaderboard_sync, with
+        the etag of the status it comes from or None if that isn't known yet
+        """
+        table = self._table(evaluation_id, columns)
+        self._upsert(table, columns, leaderboard_sync.leaderboard_fields(submission, fields), etag)
+        self.db.commit()
+
+    def sync(self, evaluation_id, columns, bundles, annotations):
+        """
+        Brings the mirror of an evaluation in line with its SCORED
+        submissions, rebuilding only the rows whose status etag changed and
+        dropping the rows of submissions that aren't SCORED anymore
+
+        :param bundles: (submission, status) of every SCORED submission
+        :param annotations: annotations(status) gives the scores of a status
+        :returns: (rows rebuilt, rows dropped)
+        """
+        table = self._table(evaluation_id, columns)
+        etags = dict(self.db.execute("select objectId, _etag from %s" % table))
+        rebuilt = 0
+        for submission, status in bundles:
+            mirrored = etags.pop(str(submission['id']), None)
+            if mirrored is not None and mirrored == status.get('etag'):
+                continue
+            self._upsert(table, columns, leaderboard_sync.leaderboard_fields(submission, annotations(status)), status.get('etag'))
+            rebuilt += 1
+        self.db.executemany("delete from %s where objectId = ?" % table, [(dropped,) for dropped in etags])
+        self.db.commit()
+        return rebuilt, len(etags)
+
+    def rows(self, evaluation_id, columns, order_by=None):
+        """
+        Rows of the leaderboard of an evaluation, projected on the columns
+        the mirror has
+
+        :param columns: names of the columns wanted
+        :returns: (names of the columns returned, list of rows)
+        """
+        table = self._table(evaluation_id, [])
+        names = [name for name in columns if name in self._columns[str(evaluation_id)]]
+        if not names:
+            return names, []
+        sql = "select %s from %s" % (", ".join(_quote(name) for name in names), table)
+        if order_by:
+            sql += " order by %s" % _quote(order_by)
+        return names, self.db.execute(sql).fetchall()
+
+    def frame(self, evaluation_id, columns):
+        """
+        The leaderboard of an evaluation as a pandas DataFrame of columns
+        """
+        names, rows = self.rows(evaluation_id, columns)
+        return pd.DataFrame.from_records(rows, columns=names)
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,159 @@
+##-----------------------------------------------------------------------------
+##
+## batched inserts and updates of the rows of a leaderboard table
+##
+##-----------------------------------------------------------------------------
+import sys
+import traceback
+import synapseclient
+from synapseclient.table import Row, RowSet, to_boolean
+
+## rows written per table transaction
+UPLOAD_BATCH_SIZE = 500
+
+## leaderboard columns filled in from the submission rather than its scores
+SUBMISSION_FIELDS = (('objectId', 'id'), ('userId', 'userId'), ('entityId', 'entityId'),
+                     ('versionNumber', 'versionNumber'), ('name', 'name'))
+
+
+def leaderboard_fields(submission, fields):
+    """
+    The values of a leaderboard row: the scoring statistics and team name
+    in fields plus the identity of the submission
+    """
+    fields = dict(fields)
+    for column, key in SUBMISSION_FIELDS:
+        fields[column] = submission[key] if key in submission else None
+    return fields
+
+
+def _cell(value, header):
+    """A table value in the type its column reads back as, for comparison"""
+    if value is None or value == '':
+        return None
+    column_type = header.get('columnType', 'STRING')
+    if column_type == 'DOUBLE':
+        return float(value)
+    elif column_type == 'INTEGER':
+        return int(value)
+    elif column_type == 'BOOLEAN':
+        return to_boolean(value)
+    return unicode(value)
+
+
+class LeaderboardSync(object):
+    """
+    Inserts and updates the rows of a leaderboard table, one row per
+    submission. The table is read once, on the first add, into an index of
+    rows by objectId. Each add then compares the new row with the indexed
+    one, and flush writes the new and changed rows in transactions of up to
+    batch_size rows. Unchanged rows aren't written at all.
+
+    Use it as a context manager to flush whatever is left at the end:
+
+        with LeaderboardSync(syn, table_id) as leaderboard:
+            for submission, status in bundles:
+                ...
+                leaderboard.add(submission, score)
+    """
+
+    def __init__(self, syn, table_id, batch_size=UPLOAD_BATCH_SIZE, dry_run=False):
+        self.syn = syn
+        self.table_id = table_id
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.headers = None
+        self.etag = None
+        self.rows = None
+        self.inserted = 0
+        self.updated = 0
+        self._pending = []
+        self._queued = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.flush()
+            return
+        #keep the rows added before the error, but let that error be the
+        #one raised rather than any from the upload
+        try:
+            self.flush()
+        except Exception:
+            sys.stderr.write("Failed to write leaderboard rows after an error:\n")
+            traceback.print_exc()
+
+    def load(self):
+        """
+        Reads every row of the table into the index
+        """
+        rowset = self.syn.tableQuery('select * from %s' % self.table_id, resultsAs="rowset").asRowSet()
+        self.headers = rowset['headers']
+        self.etag = rowset.get('etag')
+        names = [header['name'] for header in self.headers]
+        self._object_id = names.index('objectId')
+        self.rows = {}
+        for row in rowset['rows']:
+            object_id = unicode(row['values'][self._object_id])
+            if object_id in self.rows:
+                ## shouldn't happen
+                raise RuntimeError("Multiple entries in leaderboard table %s for submission %s" % (self.table_id, object_id))
+            self.rows[object_id] = row
+
+    def add(self, submission, fields):
+        """
+        Queues the row of a submission for insert, or for update if the
+        table has a different row for it already
+
+        :param fields: a dictionary including all scoring statistics plus the team name for the submission.
+        """
+        if self.rows is None:
+            self.load()
+        fields = leaderboard_fields(submission, fields)
+        values = [fields.get(header['name'], None) for header in self.headers]
+        object_id = unicode(submission['id'])
+        existing = self.rows.get(object_id)
+        if object_id in self._queued:
+            ## still waiting to be written, so write the latest values
+            existing['values'] = values
+            return
+        if existing is None:
+            row = Row(values)
+        elif [_cell(value, header) for value, header in zip(values, self.headers)] != \
+             [_cell(value, header) for value, header in zip(existing['values'], self.headers)]:
+            row = Row(values, rowId=existing['rowId'], versionNumber=existing['versionNumber'])
+        else:
+            return
+        self.rows[object_id] = row
+        self._pending.append(row)
+        self._queued.add(object_id)
+
+    def flush(self):
+        """
+        Writes every queued row
+        """
+        while self._pending:
+            batch = self._pending[:self.batch_size]
+            self._store(batch)
+            del self._pending[:len(batch)]
+        self._queued.clear()
+
+    def _store(self, rows):
+        inserts = sum(1 for row in rows if 'rowId' not in row)
+        if self.dry_run:
+            for row in rows:
+                print "update row %s" % row['rowId'] if 'rowId' in row else "insert new row", row['values']
+        else:
+            rowset = RowSet(headers=self.headers, tableId=self.table_id, rows=rows)
+            if self.etag is not None:
+                rowset['etag'] = self.etag
+            response = self.syn.store(synapseclient.Table(self.table_id, rowset))
+            self.etag = response.etag or self.etag
+            ## later updates of these rows need their new row IDs and versions
+            for row, reference in zip(rows, response.rowset.get('rows', [])):
+                row['rowId'] = reference['rowId']
+                row['versionNumber'] = reference['versionNumber']
+        self.inserted += inserts
+        self.updated += len(rows) - inserts
@@ -3,72 +3,185 @@ import errno
 import inspect
 import os
 import shutil
+import socket
 import sys
+import threading
 import time
 from datetime import timedelta
 
 LOCK_DEFAULT_MAX_AGE = timedelta(hours=2)
 
+## seconds between polls of a busy lock by a blocking acquire
+LOCK_POLL_INTERVAL = 1
+
 
 class LockedException(Exception):
     pass
 
-def acquire_lock_or_fail(name, max_age=LOCK_DEFAULT_MAX_AGE):
-    lock = Lock(name, max_age=max_age)
-    if lock.acquire():
+def lock_name(*parts):
+    """
+    Name of a lock on one part of the work, like lock_name('challenge',
+    'score', evaluation_id), leaving out parts that are None
+    """
+    return ".".join(str(part) for part in parts if part is not None)
+
+def acquire_lock_or_fail(name, max_age=LOCK_DEFAULT_MAX_AGE, timeout=None, heartbeat=None):
+    lock = Lock(name, max_age=max_age, heartbeat=heartbeat)
+    if lock.acquire(timeout=timeout):
         return lock
-    raise LockedException("A lock exists named %s who's age is: %s" % (name, unicode(lock.get_age())))
+    owner = lock.get_owner()
+    raise LockedException("A lock exists named %s who's age is: %s%s" % (
+        name, unicode(lock.get_age()),
+        " held by pid %s on %s" % (owner['pid'], owner['host']) if owner else ""))
 
 
 class Lock(object):
     """
     Implements a lock by making a directory named [lockname].lock
+
+    The directory holds an owner file with the PID and host of the holder.
+    A lock held by a process on this host that no longer exists is broken
+    straight away, any other lock once it is older than max_age. With a
+    heartbeat, a background thread refreshes the age of a held lock every
+    heartbeat seconds, so max_age can be short and a crashed holder only
+    blocks others for that long.
     """
     SUFFIX = 'lock'
+    OWNER_FILE = 'owner'
 
-    def __init__(self, name, dir=None, max_age=LOCK_DEFAULT_MAX_AGE):
+    def __init__(self, name, dir=None, max_age=LOCK_DEFAULT_MAX_AGE, heartbeat=None):
         self.name = name
         self.held = False
         self.dir = dir if dir else os.getcwd()
         self.lock_dir_path = os.path.join(self.dir, ".".join([name, Lock.SUFFIX]))
         self.max_age = max_age
+        self.heartbeat = heartbeat
+        self.pid = os.getpid()
+        self.host = socket.gethostname()
+        self._stop_heartbeat = None
 
     def get_age(self):
-        return timedelta(seconds=time.time() - os.path.getmtime(self.lock_dir_path))
+        try:
+            return timedelta(seconds=time.time() - os.path.getmtime(self.lock_dir_path))
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+            return timedelta(0)
 
-    def acquire(self, break_old_locks=True):
-        """Try to acquire lock. Return True on success or False otherwise"""
+    def get_owner(self):
+        """The pid and host of the holder as a dict, or None if unknown"""
+        try:
+            with open(os.path.join(self.lock_dir_path, Lock.OWNER_FILE)) as f:
+                pid, host = f.read().split(None, 1)
+            return dict(pid=int(pid), host=host.strip())
+        except (IOError, ValueError):
+            return None
+
+    def is_stale(self):
+        """True if the holder died on this host or stopped refreshing the lock"""
+        owner = self.get_owner()
+        if owner is not None and owner['host'] == self.host and not _alive(owner['pid']):
+            return True
+        return self.get_age() > self.max_age
+
+    def _write_owner(self):
+        path = os.path.join(self.lock_dir_path, Lock.OWNER_FILE)
+        tmp_path = "%s.%d" % (path, self.pid)
+        with open(tmp_path, 'w') as f:
+            f.write("%d %s\n" % (self.pid, self.host))
+        os.rename(tmp_path, path)
+
+    def _owned(self):
+        owner = self.get_owner()
+        return owner is not None and owner['pid'] == self.pid and owner['host'] == self.host
+
+    def _try_acquire(self, break_old_locks):
         try:
             os.makedirs(self.lock_dir_path)
-            self.held = True
-            # Make sure the modification times are correct
-            # On some machines, the modification time could be seconds off
-            os.utime(self.lock_dir_path, (0, time.time()))
         except OSError as err:
             if err.errno != errno.EEXIST and err.errno != errno.EACCES:
                 raise
             # already locked...
-            if break_old_locks and self.get_age() > self.max_age:
-                sys.stderr.write("Breaking lock who's age is: %s\n" % self.get_age())
-                self.held = True
-                # Make sure the modification times are correct
-                # On some machines, the modification time could be seconds off
-                os.utime(self.lock_dir_path, (0, time.time()))
-            else:
-                self.held = False
+            if not break_old_locks or not self.is_stale():
+                return False
+            sys.stderr.write("Breaking lock %s who's age is: %s\n" % (self.name, self.get_age()))
+            # moving it aside first means only one of several processes
+            # breaking the same lock at once gets to remove it
+            broken_path = "%s.broken.%d" % (self.lock_dir_path, self.pid)
+            try:
+                os.rename(self.lock_dir_path, broken_path)
+            except OSError:
+                return False
+            shutil.rmtree(broken_path, ignore_errors=True)
+            try:
+                os.makedirs(self.lock_dir_path)
+            except OSError:
+                return False
+        self._write_owner()
+        # Make sure the modification times are correct
+        # On some machines, the modification time could be seconds off
+        os.utime(self.lock_dir_path, (0, time.time()))
+        return True
+
+    def acquire(self, break_old_locks=True, timeout=None):
+        """
+        Try to acquire lock. Return True on success or False otherwise
+
+        :param timeout: seconds to keep trying while another process holds
+                        the lock, None or 0 to try once
+        """
+        deadline = time.time() + (timeout or 0)
+        while True:
+            self.held = self._try_acquire(break_old_locks)
+            if self.held or time.time() >= deadline:
+                break
+            time.sleep(min(LOCK_POLL_INTERVAL, max(0, deadline - time.time())))
+        if self.held and self.heartbeat:
+            self._start_heartbeat()
         return self.held
 
+    def _start_heartbeat(self):
+        self._stop_heartbeat = stop = threading.Event()
+        def beat():
+            while not stop.wait(self.heartbeat):
+                try:
+                    self.refresh()
+                except OSError as err:
+                    sys.stderr.write("Can't refresh lock %s: %s\n" % (self.name, err))
+        thread = threading.Thread(target=beat, name="heartbeat of lock %s" % self.name)
+        thread.daemon = True
+        thread.start()
+
+    def refresh(self):
+        """Reset the age of a held lock, for processes that hold it for long"""
+        if self.held:
+            os.utime(self.lock_dir_path, (0, time.time()))
+
     def release(self):
         """Release lock or do nothing if lock is not held"""
+        if self._stop_heartbeat is not None:
+            self._stop_heartbeat.set()
+            self._stop_heartbeat = None
         if self.held:
+            self.held = False
+            # a lock broken as stale now belongs to someone else
+            if not self._owned():
+                sys.stderr.write("Lock %s was taken over by another process\n" % self.name)
+                return
             try:
                 shutil.rmtree(self.lock_dir_path)
-                self.held = False
             except OSError as err:
                 if err.errno != errno.ENOENT:
                     raise
 
 
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as err:
+        return err.errno == errno.EPERM
+    return True
+
 
 def _sleep(seconds=0):
     print "sleeping", seconds, "seconds"
@@ -80,7 +193,7 @@ def _sleep(seconds=0):
 
 
 if __name__ == "__main__":
-    lock = acquire_lock_or_fail('foo', max_age=timedelta(seconds=10))
+    lock = acquire_lock_or_fail('foo', max_age=timedelta(seconds=10), heartbeat=2)
     try:
         parser = argparse.ArgumentParser()
 
@@ -100,4 +213,3 @@ if __name__ == "__main__":
 
     finally:
         lock.release()
-
@@ -0,0 +1,103 @@
+##-----------------------------------------------------------------------------
+##
+## cache of user profile and team lookups, kept between runs
+##
+##-----------------------------------------------------------------------------
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+
+## on-disk store, an SQLite database shared by every run
+cache_path = os.path.join(os.getcwd(), 'lookup_cache.db')
+
+## seconds before a cached profile or team is looked up again
+TTL = 24 * 60 * 60
+
+## entries kept in memory in front of the on-disk store
+CAPACITY = 1000
+
+## the profile fields get_user_name and the leaderboards need
+PROFILE_FIELDS = ('ownerId', 'userName', 'firstName', 'lastName')
+
+SCHEMA = """
+create table if not exists lookups (
+    kind        text,
+    id          text,
+    fetched_at  real,
+    value       text,
+    primary key (kind, id)
+)"""
+
+
+def profile_fields(profile):
+    """
+    The fields of a UserProfile or UserGroupHeader worth caching
+    """
+    return {field: profile[field] for field in PROFILE_FIELDS if field in profile}
+
+
+class LookupCache(object):
+    """
+    Profiles and teams by kind and ID, in an in-memory LRU in front of an
+    on-disk SQLite table, which the daemon and cron runs can share. Entries
+    older than ttl seconds are fetched again.
+    """
+
+    def __init__(self, path=None, ttl=TTL, capacity=CAPACITY):
+        self.ttl = ttl
+        self.capacity = capacity
+        self._memory = OrderedDict()
+        if path and os.path.dirname(path) and not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        self.db = sqlite3.connect(path or ':memory:')
+        #write-ahead logging lets other runs read while one writes
+        self.db.execute("pragma journal_mode=wal")
+        self.db.execute("pragma synchronous=normal")
+        self.db.execute(SCHEMA)
+        self.db.commit()
+
+    def _fresh(self, entry):
+        return entry is not None and time.time() - entry[0] < self.ttl
+
+    def _remember(self, key, entry):
+        self._memory.pop(key, None)
+        self._memory[key] = entry
+        while len(self._memory) > self.capacity:
+            self._memory.popitem(last=False)
+
+    def get(self, kind, id, fetch):
+        """
+        The cached value for id, or fetch(id) if there is none or it expired
+        """
+        key = (kind, unicode(id))
+        entry = self._memory.get(key)
+        if entry is None:
+            row = self.db.execute("select fetched_at, value from lookups where kind = ? and id = ?", key).fetchone()
+            if row is not None:
+                entry = (row[0], json.loads(row[1]))
+        if self._fresh(entry):
+            self._remember(key, entry)
+            return entry[1]
+        value = fetch(id)
+        self.put(kind, id, value)
+        return value
+
+    def put(self, kind, id, value):
+        key = (kind, unicode(id))
+        entry = (time.time(), value)
+        self._remember(key, entry)
+        self.db.execute("insert or replace into lookups (kind, id, fetched_at, value) values (?, ?, ?, ?)",
+                        key + (entry[0], json.dumps(value)))
+        self.db.commit()
+
+    def stale(self, kind):
+        """
+        IDs of every entry of kind in the store that has expired
+        """
+        rows = self.db.execute("select id from lookups where kind = ? and fetched_at <= ?", (kind, time.time() - self.ttl))
+        return [str(row[0]) for row in rows]
+
+    def close(self):
+        self.db.close()
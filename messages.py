@@ -1,7 +1,10 @@
 ## Messages for challenge scoring script.
 
+import Queue
 import string
 import sys
+import threading
+import time
 import warnings
 
 
@@ -13,6 +16,12 @@ send_notifications = True
 acknowledge_receipt = False
 dry_run = False
 
+## background sender, see start_dispatcher
+dispatcher = None
+
+## how many times sending a message is attempted before giving up
+SEND_ATTEMPTS = 4
+
 
 ## Edit these URLs to point to your challenge and its support forum
 defaults = dict(
@@ -111,6 +120,19 @@ Sincerely,
 the scoring script
 """
 
+error_digest_subject_template = "{count} errors in the scoring script"
+error_digest_template = """\
+Hello Challenge Administrator,
+
+The scoring script encountered {count} errors in this run:
+
+{message}
+
+Sincerely,
+
+the scoring script
+"""
+
 
 class DefaultingFormatter(string.Formatter):
     """
@@ -158,6 +180,10 @@ def scoring_succeeded(userIds, **kwargs):
 
 def scoring_error(userIds, **kwargs):
     if send_messages:
+        if dispatcher is not None:
+            ## held back for the digest sent by stop_dispatcher
+            return dispatcher.add_notification(userIds, kwargs, scoring_error_subject_template,
+                                               scoring_error_template)
         return send_message(userIds=userIds,
                             subject_template=scoring_error_subject_template,
                             message_template=scoring_error_template,
@@ -165,6 +191,9 @@ def scoring_error(userIds, **kwargs):
 
 def error_notification(userIds, **kwargs):
     if send_notifications:
+        if dispatcher is not None:
+            ## held back for the digest sent by stop_dispatcher
+            return dispatcher.add_notification(userIds, kwargs)
         return send_message(userIds=userIds,
                             subject_template=notification_subject_template,
                             message_template=error_notification_template,
@@ -181,14 +210,139 @@ def send_message(userIds, subject_template, message_template, kwargs):
         print message
         return None
     elif syn:
-        response = syn.sendMessage(
-            userIds=userIds,
-            messageSubject=subject,
-            messageBody=message)
-        print "sent: ", unicode(response).encode('utf-8')
-        return response
+        if dispatcher is not None:
+            return dispatcher.submit(userIds, subject, message)
+        return _send(userIds, subject, message)
     else:
         sys.stderr.write("Can't send message. No Synapse object configured\n")
 
+def _send(userIds, subject, message):
+    response = syn.sendMessage(
+        userIds=userIds,
+        messageSubject=subject,
+        messageBody=message)
+    print "sent: ", unicode(response).encode('utf-8')
+    return response
+
+
+##---------------------------------------------------------
+## background dispatch
+##---------------------------------------------------------
+
+class Dispatcher(object):
+    """
+    Sends messages from a pool of background threads, retrying failed
+    sends with exponential backoff, so callers never wait on delivery.
+    Error notifications and scoring errors, which go to the admins, are
+    held back and combined into a single digest per set of recipients when
+    the dispatcher stops.
+    """
+
+    def __init__(self, threads=4, attempts=SEND_ATTEMPTS):
+        self.attempts = attempts
+        self.queue = Queue.Queue()
+        self.notifications = []
+        self.lock = threading.Lock()
+        self.threads = [threading.Thread(target=self._work) for i in range(threads)]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def submit(self, userIds, subject, message):
+        self.queue.put((userIds, subject, message))
+
+    def add_notification(self, userIds, kwargs, subject_template=notification_subject_template,
+                         message_template=error_notification_template):
+        """
+        Holds a message back for the digest, with the templates it is sent
+        with if it turns out to be the only one for its recipients
+        """
+        with self.lock:
+            self.notifications.append((tuple(userIds), kwargs, subject_template, message_template))
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            userIds, subject, message = item
+            for attempt in range(self.attempts):
+                try:
+                    _send(userIds, subject, message)
+                    break
+                except Exception as ex1:
+                    if attempt == self.attempts - 1:
+                        sys.stderr.write("Giving up on message \"%s\" to %s: %s\n" % (subject, userIds, ex1))
+                    else:
+                        time.sleep(2 ** attempt)
+
+    def send_digests(self):
+        """
+        Queues the held back admin notifications, one digest per set of
+        recipients
+        """
+        with self.lock:
+            notifications, self.notifications = self.notifications, []
+        recipients = []
+        by_recipients = {}
+        for notification in notifications:
+            userIds = notification[0]
+            if userIds not in by_recipients:
+                recipients.append(userIds)
+                by_recipients[userIds] = []
+            by_recipients[userIds].append(notification[1:])
+        for userIds in recipients:
+            batch = by_recipients[userIds]
+            if len(batch) == 1:
+                kwargs, subject_template, message_template = batch[0]
+                send_message(list(userIds), subject_template, message_template, kwargs)
+            else:
+                parts = []
+                for i, (kwargs, subject_template, message_template) in enumerate(batch):
+                    header = "%d. %s" % (i + 1, kwargs['queue_name']) if 'queue_name' in kwargs else "%d." % (i + 1)
+                    if 'submission_id' in kwargs:
+                        header += (", submission %s %s" % (kwargs['submission_id'], kwargs.get('submission_name', ''))).rstrip()
+                    parts.append("%s\n\n%s" % (header, kwargs.get('message', '')))
+                send_message(list(userIds), error_digest_subject_template, error_digest_template,
+                             dict(count=len(batch), message="\n\n".join(parts)))
+
+    def stop(self):
+        """
+        Queues the digests and waits for every queued message to be sent
+        """
+        self.send_digests()
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            #joining in slices keeps the main thread responsive to ctrl-c
+            while thread.is_alive():
+                thread.join(0.5)
+
+
+def start_dispatcher(threads=4):
+    """
+    Send messages from background threads from now on, see Dispatcher
+    """
+    global dispatcher
+    if dispatcher is None:
+        dispatcher = Dispatcher(threads)
+
+def send_digests():
+    """
+    Send the admin digests collected so far, for long running processes
+    """
+    if dispatcher is not None:
+        dispatcher.send_digests()
+
+def stop_dispatcher():
+    """
+    Send the admin digests and wait for every queued message to go out
+    """
+    global dispatcher
+    if dispatcher is not None:
+        ## the digests are queued before the threads are told to finish
+        dispatcher.stop()
+        dispatcher = None
+
 
 
@@ -0,0 +1,177 @@
+##-----------------------------------------------------------------------------
+##
+## permutation testing of submission scores
+##
+##-----------------------------------------------------------------------------
+import math
+import multiprocessing
+import numpy as np
+import scoring
+
+## upper bound on the number of elements in one batched index matrix,
+## keeps the memory of a batch around 32MB per float array
+MAX_BATCH_ELEMENTS = 2 ** 22
+
+## a run with a threshold stops once its p-value is further than this many
+## standard errors from the threshold
+STOP_SIGMAS = 4
+
+
+def permutation_matrix(rng, batch, n):
+    """
+    A batch x n matrix where every row is a random permutation of range(n)
+    """
+    return rng.rand(batch, n).argsort(axis=1)
+
+
+def seeded_batches(permute_times, n, batch_size, seed):
+    """
+    Splits permute_times permutations into memory bounded batches, each with
+    its own seed drawn from the master seed so the result does not depend on
+    how the batches are spread over processes.
+    """
+    batch_size = max(1, min(batch_size, MAX_BATCH_ELEMENTS // max(n, 1)))
+    sizes = [batch_size] * (permute_times // batch_size)
+    if permute_times % batch_size:
+        sizes.append(permute_times % batch_size)
+    seeds = np.random.RandomState(seed).randint(0, 2 ** 31 - 1, size=len(sizes))
+    return zip(sizes, seeds)
+
+
+def decided(count, done, threshold):
+    """
+    True once count exceedances out of done permutations put the p-value
+    clearly on one side of threshold
+    """
+    se = math.sqrt(threshold * (1 - threshold) / done)
+    return abs(count / float(done + 1) - threshold) > STOP_SIGMAS * se
+
+
+def run_batches(worker, payload, permute_times, n, seed=None, processes=None, batch_size=1000, stop=None):
+    """
+    Runs worker((payload, batch, seed)) for every batch of permutations,
+    in a process pool when there is more than one batch and processes
+    isn't 1, and sums up the counts returned by each batch.
+
+    :param processes: size of the process pool, None to use every core
+    :param stop: optional stop(counts, done) checked after each batch, in
+                 batch order, ending the run early when it returns True.
+                 Batches then run one round of processes at a time.
+
+    :returns: (counts, done) where done is the number of permutations run
+    """
+    tasks = [(payload, batch, batch_seed) for batch, batch_seed in seeded_batches(permute_times, n, batch_size, seed)]
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = max(1, min(processes, len(tasks)))
+    round_size = len(tasks) if stop is None else processes
+
+    pool = multiprocessing.Pool(processes) if processes > 1 else None
+    counts, done = 0, 0
+    try:
+        for start in range(0, len(tasks), round_size):
+            tasks_round = tasks[start:start + round_size]
+            results = pool.map(worker, tasks_round) if pool else map(worker, tasks_round)
+            for (_, batch, _), result in zip(tasks_round, results):
+                counts = counts + result
+                done += batch
+                if stop is not None and stop(counts, done):
+                    return counts, done
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    return counts, done
+
+
+def _auc_batch(task):
+    """
+    Counts the permutations in one batch that score at least as well as the
+    submission. Permuting the gold standard labels against the sorted belief
+    scores leaves the blocks of tied scores unchanged, so the sort is reused.
+    """
+    (truePos, starts, block, true_auroc, true_aupr), batch, seed = task
+    perm = permutation_matrix(np.random.RandomState(seed), batch, len(truePos))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision, recall, fpr = scoring.blockwise_curves(truePos[perm], starts, block)
+    auroc, aupr = scoring.curve_auc(precision, recall, fpr)
+    return np.array([np.sum(auroc >= true_auroc), np.sum(aupr >= true_aupr)])
+
+
+def auc_pvalues(predict, truth, permute_times=10000, seed=None, processes=None, batch_size=1000,
+                threshold=None, watch=(True, True)):
+    """
+    Permutation p-values of the AUROC and AUPR of a submission
+
+    :param predict: array of submitted belief scores
+    :param truth: array of gold standard labels (1 is a true positive)
+    :param permute_times: number of permutations
+    :param seed: seed for the permutations, for reproducible p-values
+    :param threshold: stop early once the watched p-values are clearly
+                      above or below this significance threshold
+    :param watch: which of (pVal_ROC, pVal_PR) decide when to stop
+
+    :returns: (pVal_ROC, pVal_PR)
+    """
+    order, starts, block = scoring.tie_blocks(predict)
+    truePos = (np.asarray(truth, dtype='float64')[order] == 1).astype('float64')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        true_auroc, true_aupr = scoring.curve_auc(*scoring.blockwise_curves(truePos, starts, block))
+    stop = None
+    if threshold is not None:
+        stop = lambda counts, done: all(decided(count, done, threshold)
+                                        for count, watched in zip(counts, watch) if watched)
+    counts, done = run_batches(_auc_batch, (truePos, starts, block, true_auroc, true_aupr),
+                               permute_times, len(truePos), seed=seed, processes=processes,
+                               batch_size=batch_size, stop=stop)
+    return tuple(count / float(done + 1) for count in counts)
+
+
+def _standardize(x):
+    """
+    Centers x and scales it to unit length, so the Pearson correlation of two
+    standardized vectors is their dot product
+    """
+    x = np.asarray(x, dtype='float64')
+    x = x - x.mean()
+    return x / np.sqrt(np.dot(x, x))
+
+
+def _correlation_batch(task):
+    """
+    Counts the permutations in one batch that correlate at least as well as
+    the submission, as a single matrix-vector product
+    """
+    (z_submitted, z_gold, true_r), batch, seed = task
+    perm = permutation_matrix(np.random.RandomState(seed), batch, len(z_submitted))
+    r = np.dot(z_submitted[perm], z_gold)
+    return np.array([np.sum(r >= true_r)])
+
+
+def correlation_pvalue(submitted, gold, permute_times=10000, seed=None, processes=1, batch_size=1000,
+                       threshold=None):
+    """
+    Permutation p-value of the Pearson correlation of a submission
+
+    :param submitted: array of submitted values
+    :param gold: array of gold standard values in the same order
+    :param permute_times: number of permutations
+    :param seed: seed for the permutations, for reproducible p-values
+    :param threshold: stop early once the p-value is clearly above or
+                      below this significance threshold
+
+    :returns: pVal, or nan when the correlation is undefined
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z_submitted = _standardize(submitted)
+        z_gold = _standardize(gold)
+    true_r = np.dot(z_submitted, z_gold)
+    if np.isnan(true_r):
+        return np.nan
+    stop = None
+    if threshold is not None:
+        stop = lambda counts, done: decided(counts[0], done, threshold)
+    counts, done = run_batches(_correlation_batch, (z_submitted, z_gold, true_r),
+                               permute_times, len(z_gold), seed=seed, processes=processes,
+                               batch_size=batch_size, stop=stop)
+    return counts[0] / float(done + 1)
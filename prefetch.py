@@ -0,0 +1,79 @@
+##-----------------------------------------------------------------------------
+##
+## background prefetching of submission downloads
+##
+##-----------------------------------------------------------------------------
+import collections
+import sys
+import threading
+
+
+class _Fetch(object):
+    """
+    One fetch running in its own thread
+    """
+    def __init__(self, fetch, item):
+        self.item = item
+        self.result = None
+        self.exc_info = None
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self._run, args=(fetch,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self, fetch):
+        try:
+            self.result = fetch(self.item)
+        except Exception:
+            self.exc_info = sys.exc_info()
+        finally:
+            self.done.set()
+
+    def wait(self):
+        #waiting in short slices keeps the main thread responsive to ctrl-c
+        while not self.done.wait(0.5):
+            pass
+        if self.exc_info:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self.result
+
+
+def background(fetch, item):
+    """
+    Starts fetch(item) in a background thread
+
+    :returns: an object whose wait() returns the result of fetch(item), or
+              raises its exception, once it is done
+    """
+    return _Fetch(fetch, item)
+
+
+def prefetch(fetch, items, depth=4):
+    """
+    Calls fetch(item) for each item, keeping up to depth fetched or running
+    calls in background threads ahead of the consumer. items is only ever
+    advanced from the calling thread, so it can be a lazy iterator like
+    getSubmissionBundles.
+
+    :returns: generator of (item, fetch(item)) in the order of items. An
+              exception raised by fetch is raised again when its item is
+              reached.
+    """
+    items = iter(items)
+    pending = collections.deque()
+
+    def fill():
+        while len(pending) < max(1, depth):
+            try:
+                item = next(items)
+            except StopIteration:
+                return
+            pending.append(_Fetch(fetch, item))
+
+    fill()
+    while pending:
+        head = pending.popleft()
+        result = head.wait()
+        #top up while the consumer works on this one
+        fill()
+        yield head.item, result
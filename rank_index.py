@@ -0,0 +1,213 @@
+##-----------------------------------------------------------------------------
+##
+## incremental leaderboard ranking, kept between runs
+##
+##-----------------------------------------------------------------------------
+import bisect
+import cPickle as pickle
+import math
+import os
+import tempfile
+
+## directory holding one index per evaluation queue
+index_dir = os.path.join(os.getcwd(), 'rank_index')
+
+
+def index_path(evaluation_id):
+    return os.path.join(index_dir, '%s.pkl' % evaluation_id)
+
+
+def load(evaluation_id, metrics):
+    """
+    The saved index of an evaluation, or a new one if there is none or it
+    ranks by other metrics
+    """
+    try:
+        with open(index_path(evaluation_id), 'rb') as f:
+            index = pickle.load(f)
+    except (IOError, EOFError, pickle.UnpicklingError):
+        return RankIndex(metrics)
+    return index if index.metrics == list(metrics) else RankIndex(metrics)
+
+
+def save(evaluation_id, index):
+    """
+    Saves an index, written to a temporary name and renamed so a reader
+    never sees half of it
+    """
+    if not os.path.exists(index_dir):
+        os.makedirs(index_dir)
+    fd, tmp_path = tempfile.mkstemp(dir=index_dir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(index, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, index_path(evaluation_id))
+    except:
+        os.remove(tmp_path)
+        raise
+
+
+class DistinctIndex(object):
+    """
+    The distinct keys of a set of submissions in sorted order, with the
+    submissions holding each key. The dense rank of a key is one more than
+    the number of smaller distinct keys, found by bisection.
+    """
+
+    def __init__(self):
+        self.keys = []
+        self.members = {}
+
+    def add(self, key, object_id):
+        """:returns: True if key is new to the index"""
+        if key in self.members:
+            self.members[key].add(object_id)
+            return False
+        bisect.insort(self.keys, key)
+        self.members[key] = set([object_id])
+        return True
+
+    def remove(self, key, object_id):
+        """:returns: True if no submission holds key anymore"""
+        members = self.members[key]
+        members.discard(object_id)
+        if members:
+            return False
+        del self.members[key]
+        del self.keys[bisect.bisect_left(self.keys, key)]
+        return True
+
+    def rank(self, key):
+        return bisect.bisect_left(self.keys, key) + 1
+
+    def members_from(self, key):
+        """The submissions holding key or any greater key"""
+        for i in xrange(bisect.bisect_left(self.keys, key), len(self.keys)):
+            for object_id in self.members[self.keys[i]]:
+                yield object_id
+
+
+def _key(value, ascending):
+    """Sort key putting the best value first and missing values last"""
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return float('inf')
+    return float(value) if ascending else -float(value)
+
+
+class RankIndex(object):
+    """
+    Ranks of the submissions to one queue, kept up to date one submission
+    at a time. Each metric gets a dense rank, best first, and the final
+    rank is the dense rank of the average metric rank, lowest first, as
+    in ranking.sc1_2_ranks and ranking.sc3_ranks.
+
+    A change to one submission only shifts the ranks at or past the keys
+    that appeared or disappeared, so upsert and remove only revisit the
+    submissions from there on and report those whose final rank moved.
+
+    :param metrics: list of (field, ascending), ascending False when
+                    higher values rank first
+    """
+
+    def __init__(self, metrics):
+        self.metrics = list(metrics)
+        self.indexes = [DistinctIndex() for metric in self.metrics]
+        self.averages = DistinctIndex()
+        ## object ID -> (metric keys, average rank, final rank)
+        self.entries = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, object_id):
+        return object_id in self.entries
+
+    def final_rank(self, object_id):
+        return self.entries[object_id][2]
+
+    def _keys(self, fields):
+        return [_key(fields.get(field), ascending) for field, ascending in self.metrics]
+
+    def holds(self, object_id, fields):
+        """True if the index has a submission with just these scores"""
+        return object_id in self.entries and self.entries[object_id][0] == self._keys(fields)
+
+    def upsert(self, object_id, fields):
+        """
+        Adds a submission with its scores in fields, or updates it
+
+        :returns: dict of object ID to new final rank, for each submission
+                  whose final rank changed, including this one
+        """
+        return self.upsert_many([(object_id, fields)])
+
+    def upsert_many(self, submissions, removed=()):
+        """
+        Adds or updates (object ID, fields) of several submissions at once,
+        and drops the submissions in removed
+
+        :returns: as upsert
+        """
+        submissions = dict(submissions)
+        removed = set(object_id for object_id in removed if object_id in self.entries and object_id not in submissions)
+        old = {object_id: self.entries.get(object_id) for object_id in set(submissions) | removed}
+        keys = {object_id: self._keys(fields) for object_id, fields in submissions.iteritems()}
+
+        ## the metric ranks past the smallest key that appeared or
+        ## disappeared have shifted
+        affected = set(submissions)
+        for i, index in enumerate(self.indexes):
+            shifted = []
+            for object_id, entry in old.iteritems():
+                if entry is not None and index.remove(entry[0][i], object_id):
+                    shifted.append(entry[0][i])
+            for object_id in submissions:
+                if index.add(keys[object_id][i], object_id):
+                    shifted.append(keys[object_id][i])
+            if shifted:
+                affected.update(index.members_from(min(shifted)))
+
+        ## new average ranks of the affected submissions, then the final
+        ## ranks of those whose average moved and of every submission past
+        ## the smallest average that appeared or disappeared
+        shifted = []
+        for object_id in removed:
+            if self.averages.remove(self.entries.pop(object_id)[1], object_id):
+                shifted.append(old[object_id][1])
+        moved = set(submissions)
+        for object_id in affected:
+            entry = self.entries.get(object_id)
+            metric_keys = keys[object_id] if object_id in submissions else entry[0]
+            average = sum(index.rank(key) for index, key in zip(self.indexes, metric_keys)) / float(len(self.indexes))
+            if entry is not None and entry[1] == average and object_id not in submissions:
+                continue
+            if entry is not None and self.averages.remove(entry[1], object_id):
+                shifted.append(entry[1])
+            if self.averages.add(average, object_id):
+                shifted.append(average)
+            self.entries[object_id] = (metric_keys, average, entry[2] if entry is not None else None)
+            moved.add(object_id)
+
+        changed = {}
+        candidates = moved
+        if shifted:
+            candidates.update(self.averages.members_from(min(shifted)))
+        for object_id in candidates:
+            metric_keys, average, final_rank = self.entries[object_id]
+            rank = self.averages.rank(average)
+            if rank != final_rank:
+                self.entries[object_id] = (metric_keys, average, rank)
+                changed[object_id] = rank
+        return changed
+
+    def remove(self, object_id):
+        """
+        Drops a submission from the index
+
+        :returns: as upsert, without the dropped submission
+        """
+        return self.upsert_many([], removed=[object_id])
+
+    def ranks(self):
+        """dict of object ID to final rank of every submission"""
+        return {object_id: entry[2] for object_id, entry in self.entries.iteritems()}
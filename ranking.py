@@ -0,0 +1,70 @@
+##-----------------------------------------------------------------------------
+##
+## ranking of scored submissions and the finalRank annotation
+##
+##-----------------------------------------------------------------------------
+import numpy as np
+
+## annotation of a submission status holding its rank on the leaderboard
+RANK_ANNOTATION = 'finalRank'
+
+
+def dense_rank(values, ascending=False):
+    """
+    1 for the best value, then one more for each next distinct value, so
+    ties share a rank. Missing values rank last.
+
+    :param values: pandas Series
+    :returns: Series of int ranks with the index of values
+    """
+    return values.rank(method='dense', ascending=ascending, na_option='bottom').astype(np.int64)
+
+
+def sc1_2_ranks(df, pvalue_threshold):
+    """
+    Ranks a leaderboard of AUPR and AUROC: a dense rank on each, then a
+    dense rank of their average, lowest first, as final_rank
+
+    :returns: a copy of df with the rank columns and p-value flags added
+    """
+    df = df.copy()
+    df['AUPR_rank'] = dense_rank(df['AUPR'])
+    df['AUROC_rank'] = dense_rank(df['AUROC'])
+    df['average_rank'] = (df['AUPR_rank'] + df['AUROC_rank']) / 2.0
+    df['final_rank'] = dense_rank(df['average_rank'], ascending=True)
+    df['AUPRpVal_boolean'] = df['nAUPR_pVal'] < pvalue_threshold
+    df['AUROCpVal_boolean'] = df['nAUROC_pVal'] < pvalue_threshold
+    return df
+
+
+def sc3_ranks(df, pvalue_threshold):
+    """
+    Ranks a leaderboard of correlation scores, highest first, as final_rank
+
+    :returns: a copy of df with the rank column and p-value flag added
+    """
+    df = df.copy()
+    df['final_rank'] = dense_rank(df['score'])
+    df['pVal_boolean'] = df['pVal'] < pvalue_threshold
+    return df
+
+
+def set_rank(status, rank):
+    """
+    Sets the rank annotation of a submission status in place, adding it if
+    the status has none and dropping copies left by earlier runs
+
+    :returns: False if the status already had just this rank, True otherwise
+    """
+    annotations = status.setdefault('annotations', {})
+    long_annos = annotations.setdefault('longAnnos', [])
+    ranks = [annotation for annotation in long_annos if annotation.get('key', None) == RANK_ANNOTATION]
+    if len(ranks) == 1 and ranks[0].get('value', None) is not None and int(ranks[0]['value']) == rank:
+        return False
+    if ranks:
+        ranks[0]['value'] = rank
+        copies = set(id(annotation) for annotation in ranks[1:])
+        long_annos[:] = [annotation for annotation in long_annos if id(annotation) not in copies]
+    else:
+        long_annos.append({'key': RANK_ANNOTATION, 'value': rank, 'isPrivate': True})
+    return True
@@ -0,0 +1,144 @@
+##-----------------------------------------------------------------------------
+##
+## validation and scoring in a child process with CPU, wall-clock and
+## memory limits
+##
+##-----------------------------------------------------------------------------
+import cPickle as pickle
+import errno
+import os
+import resource
+import select
+import signal
+import sys
+import time
+import worker_pool
+
+## seconds between checks of the wall-clock time and memory of the child
+POLL_INTERVAL = 0.1
+
+## resident set size of a process, where the system has /proc
+STATM_PATH = '/proc/%d/statm'
+
+
+class LimitExceeded(Exception):
+    pass
+
+
+def _rss(pid):
+    """Resident set size of process pid in bytes, or None if unknown"""
+    try:
+        with open(STATM_PATH % pid) as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (IOError, IndexError, ValueError):
+        return None
+
+
+def _limit_error(what, limit, unit):
+    ex = LimitExceeded("Exceeded the %s limit of %s %s" % (what, limit, unit))
+    return (ex, "%s: %s\n" % (type(ex).__name__, ex))
+
+
+class Sandbox(object):
+    """
+    Calls functions in a forked child process, killing the child once it
+    has used cpu_seconds of CPU time, run for wall_seconds or grown past
+    max_rss bytes of memory. A limit of None is no limit.
+
+    Called like worker_pool.call, a Sandbox returns (result, None) or
+    (None, (exception, traceback text)), where the exception is a
+    LimitExceeded if the child was killed. Instances can be handed to
+    worker_pool.imap, whose workers then run each call in a child of
+    their own.
+    """
+
+    def __init__(self, cpu_seconds=None, wall_seconds=None, max_rss=None, initializer=None):
+        self.cpu_seconds = cpu_seconds
+        self.wall_seconds = wall_seconds
+        self.max_rss = max_rss
+        self.initializer = initializer
+
+    def __call__(self, func, *args):
+        ## anything buffered now would otherwise be written by both processes
+        sys.stdout.flush()
+        sys.stderr.flush()
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            self._child(write_fd, func, args)
+        os.close(write_fd)
+        try:
+            return self._wait(pid, read_fd)
+        finally:
+            os.close(read_fd)
+
+    def _child(self, write_fd, func, args):
+        try:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            if self.cpu_seconds:
+                resource.setrlimit(resource.RLIMIT_CPU, (self.cpu_seconds, self.cpu_seconds + 1))
+            if self.max_rss and _rss(os.getpid()) is None:
+                ## without /proc the parent can't watch the memory of the
+                ## child, so cap its address space instead
+                resource.setrlimit(resource.RLIMIT_AS, (self.max_rss, self.max_rss))
+            if self.initializer is not None:
+                self.initializer()
+            outcome = worker_pool.call(func, *args)
+            try:
+                data = pickle.dumps(outcome, pickle.HIGHEST_PROTOCOL)
+            except Exception:
+                data = pickle.dumps((None, worker_pool.describe(sys.exc_info())), pickle.HIGHEST_PROTOCOL)
+            with os.fdopen(write_fd, 'wb') as f:
+                f.write(data)
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(0)
+
+    def _wait(self, pid, read_fd):
+        start = time.time()
+        chunks = []
+        error = None
+        while True:
+            try:
+                readable = select.select([read_fd], [], [], POLL_INTERVAL)[0]
+            except select.error as err:
+                if err.args[0] == errno.EINTR:
+                    continue
+                raise
+            if readable:
+                chunk = os.read(read_fd, 2**16)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+            if self.wall_seconds and time.time() - start > self.wall_seconds:
+                error = _limit_error('wall-clock', self.wall_seconds, 'seconds')
+            elif self.max_rss and (_rss(pid) or 0) > self.max_rss:
+                error = _limit_error('memory', self.max_rss, 'bytes')
+            if error is not None:
+                os.kill(pid, signal.SIGKILL)
+                break
+        status, usage = _wait4(pid)
+
+        if error is not None:
+            return (None, error)
+        ## SIGXCPU at the soft limit, SIGKILL at the hard one a second later
+        signaled = os.WTERMSIG(status) if os.WIFSIGNALED(status) else None
+        if self.cpu_seconds and (signaled == signal.SIGXCPU or
+                                 (signaled == signal.SIGKILL and usage.ru_utime + usage.ru_stime >= self.cpu_seconds)):
+            return (None, _limit_error('CPU time', self.cpu_seconds, 'seconds'))
+        if not chunks:
+            ex = RuntimeError("Sandboxed process died with status %d" % status)
+            return (None, (ex, "%s: %s\n" % (type(ex).__name__, ex)))
+        return pickle.loads(''.join(chunks))
+
+
+def _wait4(pid):
+    """(exit status, resource usage) of child process pid, once it ends"""
+    while True:
+        try:
+            return os.wait4(pid, 0)[1:]
+        except OSError as err:
+            if err.errno != errno.EINTR:
+                raise
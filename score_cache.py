@@ -0,0 +1,112 @@
+##-----------------------------------------------------------------------------
+##
+## scores of submission files, keyed by content so identical files and
+## rescoring runs reuse them
+##
+##-----------------------------------------------------------------------------
+import cPickle as pickle
+import os
+import tempfile
+
+## directory holding one pickle per scored (file, gold standard, version)
+cache_dir = os.path.join(os.getcwd(), 'score_cache')
+
+## the oldest used results are evicted once the cache grows past this size
+MAX_BYTES = 64 * 2**20
+
+
+def _path(key):
+    return os.path.join(cache_dir, "%s_%s_%s.pkl" % key)
+
+
+def _entries():
+    """(last used, size, path) of every cached result"""
+    if not os.path.exists(cache_dir):
+        return []
+    entries = []
+    for filename in os.listdir(cache_dir):
+        if filename.endswith('.pkl'):
+            path = os.path.join(cache_dir, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+    return entries
+
+
+def cache_key(submission_md5, goldstandard_md5, version):
+    """
+    Key of a score: the MD5 of the submission file, the MD5 of the gold
+    standard file and the version of everything else the score depends on
+    """
+    return (submission_md5, goldstandard_md5[:12], version[:12])
+
+
+def load(key):
+    """
+    The (score, message) stored under key, or None
+    """
+    path = _path(key)
+    try:
+        with open(path, 'rb') as f:
+            result = pickle.load(f)
+    except (IOError, EOFError, pickle.UnpicklingError):
+        return None
+    #a hit counts as a use for eviction
+    os.utime(path, None)
+    return result
+
+
+def store(key, result):
+    """
+    Saves (score, message) under key, written to a temporary name and
+    renamed so a reader never sees half of it, then evicts the least
+    recently used results while the cache is over MAX_BYTES
+    """
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(result, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, _path(key))
+    except:
+        os.remove(tmp_path)
+        raise
+    evict(MAX_BYTES)
+
+
+def evict(max_bytes):
+    """
+    Removes the least recently used results until the cache fits in max_bytes
+    """
+    entries = sorted(_entries())
+    total = sum(size for used, size, path in entries)
+    for used, size, path in entries:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+
+
+def invalidate(submission_md5=None, goldstandard_md5=None):
+    """
+    Removes the cached results of a submission file, of a gold standard
+    file, or every result when neither is given
+
+    :returns: how many results were removed
+    """
+    removed = 0
+    for used, size, path in _entries():
+        md5, gold, version = os.path.basename(path)[:-len('.pkl')].split('_')
+        if submission_md5 is not None and md5 != submission_md5:
+            continue
+        if goldstandard_md5 is not None and gold != goldstandard_md5[:12]:
+            continue
+        os.remove(path)
+        removed += 1
+    return removed
@@ -0,0 +1,261 @@
+##-----------------------------------------------------------------------------
+##
+## vectorized scoring kernels
+##
+##-----------------------------------------------------------------------------
+import math
+import numpy as np
+
+
+def _take(a, order):
+    """
+    Gathers a along its last axis, one row of indices per row of a
+    """
+    if a.ndim == 1:
+        return a[order]
+    return a[np.arange(a.shape[0])[:, None], order]
+
+
+def _reordered_trapz(x, y):
+    """
+    Area under the curve through the points (x, y) after sorting them by x
+    and then by y, the same as sklearn.metrics.auc(x, y, reorder=True).
+    Works row by row on 2d arrays.
+    """
+    order = np.lexsort((y, x), axis=-1)
+    return np.trapz(_take(y, order), _take(x, order), axis=-1)
+
+
+def tie_blocks(predict):
+    """
+    Sorts the belief scores once and finds the blocks of tied scores
+
+    :returns: (order, starts, block) where order sorts predict descending,
+              starts holds the sorted position where each block begins and
+              block maps each sorted position to its block
+    """
+    predict = np.asarray(predict, dtype='float64')
+    order = np.argsort(-predict, kind='mergesort')
+    predict = predict[order]
+    block_start = np.ones(len(predict), dtype=bool)
+    block_start[1:] = predict[1:] != predict[:-1]
+    starts = np.flatnonzero(block_start)
+    block = np.cumsum(block_start) - 1
+    return(order, starts, block)
+
+
+def blockwise_curves(truePos, starts, block):
+    """
+    Calculates the tie-aware interpolated Precision, Recall & False Positive
+    Rate for every prediction, from cumulative sums over the blocks.
+
+    Predictions that share a belief score form a block. Inside a block the
+    true positives are spread evenly, so the element at depth d of a block
+    with true positive density p has seen p*d true positives and (1-p)*d
+    false positives on top of everything in the previous blocks.
+
+    :param truePos: 0/1 array in descending belief score order. A 2d array
+                    is treated as one labelling per row over the same blocks.
+    :param starts, block: see tie_blocks
+
+    :returns: (precision, recall, fpr) arrays shaped like truePos
+    """
+    truePos = np.asarray(truePos, dtype='float64')
+    n = truePos.shape[-1]
+    block_numElements = np.diff(np.append(starts, n)).astype('float64')
+    block_truePos = np.add.reduceat(truePos, starts, axis=-1)
+    block_truePos_density = block_truePos / block_numElements
+
+    #cumulative stats seen till the last block
+    cum_numElements = np.cumsum(block_numElements)
+    cum_truePos = np.cumsum(block_truePos, axis=-1)
+    last_numElements = (cum_numElements - block_numElements)[block]
+    last_truePos = (cum_truePos - block_truePos)[..., block]
+    last_trueNeg = last_numElements - last_truePos
+
+    total_elements = float(n)
+    total_truePos = cum_truePos[..., -1:]
+    total_trueNeg = total_elements - total_truePos
+
+    block_depth = np.arange(1, n + 1) - starts[block]
+    density = block_truePos_density[..., block]
+    tp = last_truePos + (density * block_depth)
+    fp = last_trueNeg + ((1 - density) * block_depth)
+
+    precision = tp / (last_numElements + block_depth)
+    recall = tp / total_truePos
+    fpr = fp / total_trueNeg
+    return(precision, recall, fpr)
+
+
+def rowwise_curves(predict, truePos):
+    """
+    blockwise_curves for a 2d array of labellings whose belief scores differ
+    from row to row, so every row has its own blocks of tied scores.
+
+    :param predict: 2d array, each row sorted by descending belief score
+    :param truePos: 0/1 array shaped like predict
+
+    :returns: (precision, recall, fpr) arrays shaped like predict
+    """
+    predict = np.asarray(predict, dtype='float64')
+    truePos = np.asarray(truePos, dtype='float64')
+    rows, n = predict.shape
+
+    #blocks never run across rows, so the rows can be handled as one array
+    block_start = np.ones((rows, n), dtype=bool)
+    block_start[:, 1:] = predict[:, 1:] != predict[:, :-1]
+    block_start = block_start.ravel()
+    starts = np.flatnonzero(block_start)
+    block = np.cumsum(block_start) - 1
+    block_numElements = np.diff(np.append(starts, rows * n)).astype('float64')
+    block_truePos = np.add.reduceat(truePos.ravel(), starts)
+    block_truePos_density = block_truePos / block_numElements
+
+    #cumulative stats seen till the last block of the same row
+    cum_truePos = np.cumsum(truePos, axis=1).ravel()
+    last_numElements = (starts % n).astype('float64')[block]
+    last_truePos = (cum_truePos[starts] - truePos.ravel()[starts])[block]
+    last_trueNeg = last_numElements - last_truePos
+
+    total_truePos = np.repeat(cum_truePos[n - 1::n], n)
+    total_trueNeg = n - total_truePos
+
+    block_depth = np.arange(1, rows * n + 1) - starts[block]
+    density = block_truePos_density[block]
+    tp = last_truePos + (density * block_depth)
+    fp = last_trueNeg + ((1 - density) * block_depth)
+
+    precision = tp / (last_numElements + block_depth)
+    recall = tp / total_truePos
+    fpr = fp / total_trueNeg
+    return(precision.reshape(rows, n), recall.reshape(rows, n), fpr.reshape(rows, n))
+
+
+def interpolated_curves(predict, truth):
+    """
+    Calculates the interpolated Precision, Recall & False Positive Rate for
+    a submission from a single sort.
+
+    :param predict: array of submitted belief scores
+    :param truth: array of gold standard labels (1 is a true positive)
+
+    :returns: (precision, recall, fpr) arrays ordered by descending belief score
+    """
+    order, starts, block = tie_blocks(predict)
+    truePos = np.asarray(truth, dtype='float64')[order] == 1
+    return blockwise_curves(truePos, starts, block)
+
+
+def curve_auc(precision, recall, fpr):
+    """
+    Calculates the AUROC and AUPR from the interpolated curves returned by
+    blockwise_curves. The PR curve is anchored at recall 0 with the
+    precision of the top ranked prediction.
+    """
+    roc_auc = _reordered_trapz(fpr, recall)
+    recall_new = np.concatenate([np.zeros(recall.shape[:-1] + (1,)), recall], axis=-1)
+    precision_new = np.concatenate([precision[..., :1], precision], axis=-1)
+    PR_auc = _reordered_trapz(recall_new, precision_new)
+    return(roc_auc, PR_auc)
+
+
+def auroc_aupr(predict, truth):
+    """
+    Vectorized equivalent of challenge_config.getAUROC_PR
+
+    :returns: (AUROC, AUPR)
+    """
+    return auroc_aupr_pvalue(predict, truth)[:2]
+
+
+def auroc_aupr_pvalue(predict, truth):
+    """
+    AUROC and AUPR along with the analytic p-value of the AUROC, all from
+    the same sort
+
+    :returns: (AUROC, AUPR, pVal_ROC)
+    """
+    if len(predict) == 0:
+        return(np.nan, np.nan, np.nan)
+    order, starts, block = tie_blocks(predict)
+    truePos = np.asarray(truth, dtype='float64')[order] == 1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        roc_auc, PR_auc = curve_auc(*blockwise_curves(truePos, starts, block))
+    return(roc_auc, PR_auc, mann_whitney_pvalue(truePos, starts))
+
+
+def batch_auroc_aupr_pvalue(predict, truth):
+    """
+    auroc_aupr_pvalue for every row of a 2d array of submissions scored
+    against the same truth, with one batched sort. Every row gives exactly
+    the values auroc_aupr_pvalue gives for it on its own.
+
+    :returns: (AUROC, AUPR, pVal_ROC) arrays with one value per row
+    """
+    predict = np.asarray(predict, dtype='float64')
+    order = np.argsort(-predict, axis=1, kind='mergesort')
+    predict = _take(predict, order)
+    truePos = (np.asarray(truth, dtype='float64')[order] == 1).astype('float64')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        roc_auc, PR_auc = curve_auc(*rowwise_curves(predict, truePos))
+
+    block_start = np.ones(predict.shape, dtype=bool)
+    block_start[:, 1:] = predict[:, 1:] != predict[:, :-1]
+    pVal_ROC = np.array([mann_whitney_pvalue(truePos[i], np.flatnonzero(block_start[i]))
+                         for i in range(len(predict))])
+    return(roc_auc, PR_auc, pVal_ROC)
+
+
+def pearson(predict, truth):
+    """
+    Pearson correlation of truth with predict, or with every row of a 2d
+    predict. Row reductions follow the same summation order as 1d arrays,
+    so a row gives exactly the value it gives on its own.
+    """
+    predict = np.asarray(predict, dtype='float64')
+    truth = np.asarray(truth, dtype='float64')
+    predict = predict - predict.mean(axis=-1)[..., None]
+    truth = truth - truth.mean()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = np.sum(predict * truth, axis=-1) / np.sqrt(np.sum(predict * predict, axis=-1) * np.sum(truth * truth))
+    return np.clip(r, -1, 1)
+
+
+def mann_whitney_pvalue(truePos, starts):
+    """
+    One sided p-value of an AUROC above 0.5, from the normal approximation
+    of the Mann-Whitney U statistic with tie correction and continuity
+    correction. Ties are exactly the blocks found by tie_blocks.
+
+    :param truePos: 0/1 array in descending belief score order
+    """
+    truePos = np.asarray(truePos, dtype='float64')
+    n = len(truePos)
+    block_numElements = np.diff(np.append(starts, n)).astype('float64')
+    block_truePos = np.add.reduceat(truePos, starts)
+
+    #mid rank of each block, ranking from the lowest belief score up
+    midrank = (n - np.cumsum(block_numElements)) + (block_numElements + 1) / 2.0
+    pos = block_truePos.sum()
+    neg = n - pos
+    U = np.dot(block_truePos, midrank) - pos * (pos + 1) / 2.0
+
+    ties = np.sum(block_numElements ** 3 - block_numElements)
+    var = pos * neg / 12.0 * ((n + 1) - ties / (n * (n - 1.0))) if n > 1 else 0.0
+    if not var > 0:
+        return np.nan
+    z = (U - pos * neg / 2.0 - 0.5) / math.sqrt(var)
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def correlation_analytic_pvalue(r, n):
+    """
+    One sided p-value of a Pearson correlation above 0, from the Fisher
+    z-transformation of r over n pairs
+    """
+    if n <= 3 or np.isnan(r):
+        return np.nan
+    r = min(max(r, -1 + 1e-15), 1 - 1e-15)
+    z = np.arctanh(r) * math.sqrt(n - 3)
+    return 0.5 * math.erfc(z / math.sqrt(2))
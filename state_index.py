@@ -0,0 +1,116 @@
+##-----------------------------------------------------------------------------
+##
+## local SQLite index of submission states seen and processed by this host
+##
+##-----------------------------------------------------------------------------
+import os
+import sqlite3
+import time
+
+## default location of the index, shared by every run
+index_path = os.path.join(os.getcwd(), 'state_index.db')
+
+SCHEMA = """
+create table if not exists submissions (
+    id              text primary key,
+    evaluation_id   text,
+    name            text,
+    user_id         text,
+    team_id         text,
+    created_on      text,
+    status          text,
+    etag            text,
+    md5             text,
+    processed_at    real,
+    published_etag  text
+)"""
+
+
+class StateIndex(object):
+    """
+    The last known status, status etag and file MD5 of each submission,
+    when this host last processed it and which status etag it last
+    published to a leaderboard. An etag that differs from the indexed one
+    means the submission changed somewhere else since.
+    """
+
+    def __init__(self, path=None):
+        self.db = sqlite3.connect(path or ':memory:')
+        self.db.row_factory = sqlite3.Row
+        #every record is committed, write-ahead logging keeps that cheap
+        self.db.execute("pragma journal_mode=wal")
+        self.db.execute("pragma synchronous=normal")
+        self.db.execute(SCHEMA)
+        self.db.execute("create index if not exists by_queue on submissions (evaluation_id, status)")
+        self.db.commit()
+
+    def get(self, submission_id):
+        """
+        The indexed state of a submission as a dict, or None
+        """
+        row = self.db.execute("select * from submissions where id = ?", (str(submission_id),)).fetchone()
+        return dict(row) if row else None
+
+    def submissions(self, evaluation_id=None, status=None):
+        """
+        Indexed states, oldest submission first, optionally of one queue
+        and one status
+        """
+        sql = "select * from submissions where 1"
+        args = []
+        if evaluation_id is not None:
+            sql += " and evaluation_id = ?"
+            args.append(str(evaluation_id))
+        if status is not None:
+            sql += " and status = ?"
+            args.append(status)
+        return [dict(row) for row in self.db.execute(sql + " order by created_on, id", args)]
+
+    def record(self, submission, status, md5=None, processed=False):
+        """
+        Stores what is known about a submission bundle. Fields that are
+        unknown, like the MD5 of a file that wasn't downloaded, keep their
+        indexed value.
+
+        :param processed: True if this host just validated or scored it,
+                          in which case status holds the new status, whose
+                          etag Synapse hasn't handed back yet
+        """
+        submission_id = str(submission['id'])
+        self.db.execute("insert or ignore into submissions (id) values (?)", (submission_id,))
+        self.db.execute("""
+            update submissions set
+                evaluation_id = coalesce(?, evaluation_id),
+                name = coalesce(?, name),
+                user_id = coalesce(?, user_id),
+                team_id = coalesce(?, team_id),
+                created_on = coalesce(?, created_on),
+                status = ?,
+                etag = ?,
+                md5 = coalesce(?, md5),
+                processed_at = coalesce(?, processed_at)
+            where id = ?""",
+            (_str(submission.get('evaluationId')), submission.get('name'),
+             _str(submission.get('userId')), _str(submission.get('teamId')),
+             submission.get('createdOn'), status.get('status'),
+             None if processed else status.get('etag'), md5,
+             time.time() if processed else None, submission_id))
+        self.db.commit()
+
+    def published(self, submission_id, etag):
+        """
+        True if this status etag of the submission was already published
+        """
+        state = self.get(submission_id)
+        return state is not None and etag is not None and state['published_etag'] == etag
+
+    def mark_published(self, submission_id, etag):
+        self.db.execute("update submissions set published_etag = ? where id = ?", (etag, str(submission_id)))
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+
+def _str(value):
+    return None if value is None else str(value)
@@ -0,0 +1,117 @@
+##-----------------------------------------------------------------------------
+##
+## write-behind buffer of submission status updates
+##
+##-----------------------------------------------------------------------------
+import json
+import sys
+import time
+import traceback
+from synapseclient.exceptions import SynapseHTTPError
+
+## Synapse accepts at most this many statuses per statusBatch request
+MAX_BATCH_SIZE = 500
+
+## seconds to wait before retrying a batch that hit a 412 conflict
+RETRY_DELAY = 2
+
+
+class StatusBuffer(object):
+    """
+    Collects SubmissionStatus updates for one evaluation and uploads them
+    through /evaluation/{id}/statusBatch, flushing when batch_size statuses
+    are waiting or the oldest one has waited flush_seconds.
+
+    Each upload is a complete batch of its own, so a 412 conflict only
+    retries that batch, after refreshing the etags of its statuses. The
+    batch size doubles after a clean upload, up to max_batch_size, and
+    halves after a conflict.
+
+    Use it as a context manager to flush whatever is left at the end:
+
+        with StatusBuffer(syn, evaluation.id) as buffer:
+            for submission, status in bundles:
+                ...
+                buffer.add(status, on_stored=send_message)
+    """
+
+    def __init__(self, syn, evaluation_id, batch_size=20, max_batch_size=MAX_BATCH_SIZE,
+                 flush_seconds=60, retries=5, dry_run=False):
+        self.syn = syn
+        self.evaluation_id = evaluation_id
+        self.batch_size = batch_size
+        self.max_batch_size = max_batch_size
+        self.flush_seconds = flush_seconds
+        self.retries = retries
+        self.dry_run = dry_run
+        self.uploads = 0
+        self._pending = []
+        self._oldest = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.flush()
+            return
+        #keep the updates made before the error, but let that error be the
+        #one raised rather than any from the upload
+        try:
+            self.flush()
+        except Exception:
+            sys.stderr.write("Failed to flush status updates after an error:\n")
+            traceback.print_exc()
+
+    def add(self, status, on_stored=None):
+        """
+        Queues a status for upload. on_stored(status) is called once the
+        status is stored, so messages about it go out after the update,
+        never for an update that failed. In a dry run nothing is stored but
+        on_stored is still called, so callers that keep state of their own
+        have to check dry_run.
+        """
+        self._pending.append((status, on_stored))
+        if self._oldest is None:
+            self._oldest = time.time()
+        if len(self._pending) >= self.batch_size or time.time() - self._oldest >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        """
+        Uploads every queued status
+        """
+        while self._pending:
+            batch = self._pending[:self.batch_size]
+            self._upload([status for status, on_stored in batch])
+            del self._pending[:len(batch)]
+            for status, on_stored in batch:
+                if on_stored is not None:
+                    on_stored(status)
+        self._oldest = None
+
+    def _upload(self, statuses):
+        if self.dry_run:
+            return
+        uri = "/evaluation/%s/statusBatch" % self.evaluation_id
+        for retry in range(self.retries):
+            try:
+                batch = {"statuses"     : statuses,
+                         "isFirstBatch" : True,
+                         "isLastBatch"  : True,
+                         "batchToken"   : None}
+                self.syn.restPUT(uri, json.dumps(batch))
+                self.uploads += 1
+                self.batch_size = min(self.max_batch_size, self.batch_size * 2)
+                return
+            except SynapseHTTPError as err:
+                # on 412 ConflictingUpdateException we want to retry
+                if err.response.status_code != 412 or retry == self.retries - 1:
+                    raise
+                self.batch_size = max(1, self.batch_size // 2)
+                time.sleep(RETRY_DELAY)
+                self._refresh_etags(statuses)
+
+    def _refresh_etags(self, statuses):
+        for status in statuses:
+            status['etag'] = self.syn.getSubmissionStatus(status['id'])['etag']
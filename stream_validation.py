@@ -0,0 +1,139 @@
+##-----------------------------------------------------------------------------
+##
+## single pass, chunked validation of submission files
+##
+##-----------------------------------------------------------------------------
+import os
+import numpy as np
+import pandas as pd
+
+BOM_SUBJECTID = '\xef\xbb\xbfSUBJECTID'
+
+## how many offending values to spell out in each problem
+MAX_LISTED = 100
+
+
+class _Listing(object):
+    """
+    Collects offending values, keeping only the first few for the message
+    """
+    def __init__(self):
+        self.values = []
+        self.count = 0
+
+    def extend(self, values):
+        values = list(values)
+        self.values.extend(values[:MAX_LISTED - len(self.values)])
+        self.count += len(values)
+
+    def __len__(self):
+        return self.count
+
+    def __str__(self):
+        text = ','.join(self.values)
+        if self.count > len(self.values):
+            text += ' ...and %d more' % (self.count - len(self.values))
+        return text
+
+
+def validate_stream(path, goldstandard, column, label, max_bytes=None, max_rows=None, chunksize=100000):
+    """
+    Validates a submission in one pass over chunks of the file, checking the
+    header, NA values, duplicates, SUBJECTID membership against the gold
+    standard index and that values are numerical. Files over max_bytes or
+    max_rows are rejected as soon as the limit is hit.
+
+    :param goldstandard: a gold_store.GoldStandard
+    :param column: name of the prediction column
+    :param label: name of the challenge, for messages
+
+    :returns: (problems, predict) where problems lists every problem found
+              and predict holds the submitted values in gold standard
+              order, or is None if there were problems
+    """
+    if max_bytes is not None:
+        file_size = os.path.getsize(path)
+        if file_size > max_bytes:
+            return ["Submitted file is %d bytes, the limit is %d bytes" % (file_size, max_bytes)], None
+
+    problems = []
+    seen = np.zeros(goldstandard.size, dtype=bool)
+    predict = np.empty(goldstandard.size, dtype='float64')
+    predict.fill(np.nan)
+    duplicated = _Listing()
+    unknown = _Listing()
+    unknown_seen = set()
+    na_values = na_ids = non_numeric = False
+    rows = 0
+
+    #the header is checked on its own, so a file without rows gets it checked too
+    try:
+        headers = list(pd.read_csv(path, dtype=str, nrows=0).columns)
+        reader = iter(pd.read_csv(path, dtype=str, chunksize=chunksize))
+    except Exception:
+        return ["Submitted file must be a comma-delimited file"], None
+    #FIX BYTE CASE
+    if headers and headers[0] == BOM_SUBJECTID:
+        headers[0] = 'SUBJECTID'
+    if 'SUBJECTID' not in headers:
+        return ['SUBJECTID must be one of the column headers\nYour column headers= %s' % ','.join(headers)], None
+    if column not in headers:
+        return ['%s must be one of the column headers for %s\nYour column headers= %s' % (column, label, ','.join(headers))], None
+
+    while True:
+        try:
+            chunk = next(reader)
+        except StopIteration:
+            break
+        except Exception:
+            return ["Submitted file must be a comma-delimited file"], None
+        chunk.columns = headers
+
+        rows += len(chunk)
+        if max_rows is not None and rows > max_rows:
+            return ["Submitted file has more than %d rows" % max_rows], None
+
+        values = chunk[column]
+        numeric = pd.to_numeric(values, errors='coerce').values
+        has_id = chunk['SUBJECTID'].notnull().values
+        na_values = na_values or values.isnull().any()
+        na_ids = na_ids or not has_id.all()
+        non_numeric = non_numeric or (values.notnull().values & np.isnan(numeric)).any()
+
+        ids = chunk['SUBJECTID'].values[has_id]
+        numeric = numeric[has_id]
+        positions = goldstandard.positions(ids)
+        known = positions >= 0
+
+        #duplicates of template SUBJECTIDs, in this chunk or an earlier one
+        known_positions = positions[known]
+        dup = np.ones(len(known_positions), dtype=bool)
+        dup[np.unique(known_positions, return_index=True)[1]] = False
+        dup |= seen[known_positions]
+        duplicated.extend(ids[known][dup])
+        seen[known_positions] = True
+        predict[known_positions[~dup]] = numeric[known][~dup]
+
+        for subject_id in ids[~known]:
+            if subject_id in unknown_seen:
+                duplicated.extend([subject_id])
+            else:
+                unknown_seen.add(subject_id)
+                unknown.extend([subject_id])
+
+    if na_values:
+        problems.append('NA values are not allowed')
+    if na_ids:
+        problems.append('NA subjectIds are not allowed')
+    if duplicated:
+        problems.append('No duplicate SUBJECTID allowed.\nDuplicated values=%s' % duplicated)
+    if unknown:
+        problems.append('All SUBJECTIDs in your prediction file must also be in the template.\n%s not part of template SUBJECTIDs' % unknown)
+    missing = _Listing()
+    missing.extend(goldstandard.subject_ids[~seen])
+    if missing:
+        problems.append("You have missing SUBJECTIDs.\nYou are missing %s" % missing)
+    if non_numeric:
+        problems.append('Submissions must be numerical values')
+
+    return problems, (None if problems else predict)
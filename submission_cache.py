@@ -0,0 +1,76 @@
+##-----------------------------------------------------------------------------
+##
+## parsed submissions, carried from validation into scoring
+##
+##-----------------------------------------------------------------------------
+import hashlib
+import os
+import tempfile
+import numpy as np
+
+## directory holding one .npy file per validated submission
+cache_dir = os.path.join(os.getcwd(), 'submission_cache')
+
+
+def file_md5(path, block_size=2**20):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def cache_key(submission_id, path, md5=None):
+    """
+    Key of a parsed submission: its submission ID and the MD5 of its file,
+    which is computed unless already known
+    """
+    return (str(submission_id), md5 or file_md5(path))
+
+
+def _path(key, goldstandard):
+    submission_id, md5 = key
+    return os.path.join(cache_dir, "%s_%s_%s.npy" % (submission_id, md5, goldstandard.digest[:12]))
+
+
+def store(key, goldstandard, predict):
+    """
+    Saves the submitted values laid out in gold standard order. The file is
+    written to a temporary name and renamed, so a reader never sees half of it.
+    """
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, np.ascontiguousarray(predict, dtype='float64'))
+        os.rename(tmp_path, _path(key, goldstandard))
+    except:
+        os.remove(tmp_path)
+        raise
+
+
+def load(key, goldstandard):
+    """
+    The memory mapped values saved by store, or None if this submission
+    file wasn't validated against this gold standard layout
+    """
+    path = _path(key, goldstandard)
+    if not os.path.exists(path):
+        return None
+    predict = np.load(path, mmap_mode='r')
+    if predict.shape != (goldstandard.size,):
+        return None
+    return predict
+
+
+def discard(key):
+    """
+    Removes every parsed copy of a submission
+    """
+    if not os.path.exists(cache_dir):
+        return
+    prefix = "%s_%s_" % key
+    for filename in os.listdir(cache_dir):
+        if filename.startswith(prefix):
+            os.remove(os.path.join(cache_dir, filename))
@@ -0,0 +1,52 @@
+##-----------------------------------------------------------------------------
+##
+## tests of the local SQLite mirror of the leaderboards
+##
+##-----------------------------------------------------------------------------
+import unittest
+import numpy as np
+import leaderboard_mirror
+
+COLUMNS = [{'name': 'objectId', 'columnType': 'STRING'},
+           {'name': 'AUPR', 'columnType': 'DOUBLE'},
+           {'name': 'nAUPR_pVal', 'columnType': 'DOUBLE'},
+           {'name': 'AUPRpVal_boolean', 'columnType': 'BOOLEAN'}]
+
+
+def submission(object_id):
+    return {'id': object_id, 'userId': '273950', 'entityId': 'syn123', 'versionNumber': 1, 'name': 'sub'}
+
+
+class LeaderboardMirrorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.mirror = leaderboard_mirror.LeaderboardMirror()
+
+    def tearDown(self):
+        self.mirror.close()
+
+    def test_pvalue_strings_stored_as_numbers(self):
+        self.mirror.upsert(u'7991328', COLUMNS, submission(u'1'),
+                           {'AUPR': 0.5, 'nAUPR_pVal': '1.00e-04', 'AUPRpVal_boolean': np.bool_(True)})
+        names, rows = self.mirror.rows(7991328, ['objectId', 'nAUPR_pVal', 'AUPRpVal_boolean'])
+        self.assertEqual(rows, [(u'1', 1e-4, 1)])
+
+    def test_evaluation_id_types(self):
+        self.mirror.upsert(7991328, COLUMNS[:2], submission('1'), {'AUPR': 0.5})
+        self.mirror.upsert(u'7991328', COLUMNS, submission('2'), {'AUPR': 0.7, 'nAUPR_pVal': 0.01})
+        names, rows = self.mirror.rows(7991328, ['objectId', 'AUPR', 'nAUPR_pVal'])
+        self.assertEqual(names, ['objectId', 'AUPR', 'nAUPR_pVal'])
+        self.assertEqual(sorted(rows), [(u'1', 0.5, None), (u'2', 0.7, 0.01)])
+
+    def test_sync(self):
+        self.mirror.upsert('7991328', COLUMNS, submission('1'), {'AUPR': 0.5}, etag='a')
+        self.mirror.upsert('7991328', COLUMNS, submission('2'), {'AUPR': 0.6}, etag='b')
+        bundles = [(submission('1'), {'etag': 'a'}), (submission('3'), {'etag': 'c'})]
+        rebuilt, dropped = self.mirror.sync('7991328', COLUMNS, bundles, lambda status: {'AUPR': 0.9})
+        self.assertEqual((rebuilt, dropped), (1, 1))
+        names, rows = self.mirror.rows('7991328', ['objectId', 'AUPR'], order_by='objectId')
+        self.assertEqual(rows, [(u'1', 0.5), (u'3', 0.9)])
+
+
+if __name__ == '__main__':
+    unittest.main()
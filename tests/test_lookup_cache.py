@@ -0,0 +1,52 @@
+##-----------------------------------------------------------------------------
+##
+## tests of the profile and team lookup cache
+##
+##-----------------------------------------------------------------------------
+import os
+import shutil
+import tempfile
+import unittest
+import lookup_cache
+
+
+class LookupCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'lookup_cache.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_unicode_id(self):
+        cache = lookup_cache.LookupCache(self.path)
+        profile = {u'ownerId': u'3324230', u'userName': u'r\xe9ka'}
+        self.assertEqual(cache.get('profile', u'3324230', lambda id: profile), profile)
+        cache.close()
+
+        cache = lookup_cache.LookupCache(self.path)
+        self.assertEqual(cache.get('profile', u'3324230', self.fail), profile)
+        self.assertEqual(cache.get('profile', '3324230', self.fail), profile)
+        cache.close()
+
+    def test_shared_between_runs(self):
+        daemon = lookup_cache.LookupCache(self.path)
+        cron = lookup_cache.LookupCache(self.path)
+        daemon.put('team', 3345, {'id': 3345, 'name': 'team one'})
+        cron.put('profile', u'273950', {'userName': 'someone'})
+        self.assertEqual(cron.get('team', '3345', self.fail), {'id': 3345, 'name': 'team one'})
+        self.assertEqual(daemon.get('profile', 273950, self.fail), {'userName': 'someone'})
+        daemon.close()
+        cron.close()
+
+    def test_stale(self):
+        cache = lookup_cache.LookupCache(self.path, ttl=-1)
+        cache.put('team', u'3345', {'name': u'team \xe9'})
+        cache.put('profile', u'273950', {'userName': 'someone'})
+        self.assertEqual(cache.stale('team'), ['3345'])
+        cache.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
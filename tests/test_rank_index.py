@@ -0,0 +1,63 @@
+##-----------------------------------------------------------------------------
+##
+## tests of incremental ranking against the full recompute
+##
+##-----------------------------------------------------------------------------
+import unittest
+import numpy as np
+import pandas as pd
+import challenge_config as conf
+import rank_index
+import ranking
+
+
+class RankIndexTest(unittest.TestCase):
+
+    def full_ranks(self, scores):
+        df = pd.DataFrame([dict(fields, objectId=object_id, nAUPR_pVal=1.0, nAUROC_pVal=1.0)
+                           for object_id, fields in scores.iteritems()])
+        df = ranking.sc1_2_ranks(df, conf.PVALUE_THRESHOLD)
+        return dict(zip(df['objectId'], df['final_rank']))
+
+    def random_fields(self, rng):
+        #few distinct values, so there are plenty of ties
+        return {'AUPR': rng.randint(0, 6) / 5.0, 'AUROC': rng.randint(0, 6) / 5.0}
+
+    def test_matches_full_ranks(self):
+        rng = np.random.RandomState(3)
+        index = rank_index.RankIndex(conf.SC1_2_RANK_METRICS)
+        scores = {}
+        ranks = {}
+        for step in range(300):
+            action = rng.rand()
+            if action < 0.2 and scores:
+                object_id = sorted(scores)[rng.randint(len(scores))]
+                del scores[object_id]
+                del ranks[object_id]
+                ranks.update(index.remove(object_id))
+            elif action < 0.3:
+                batch = dict((str(rng.randint(60)), self.random_fields(rng)) for i in range(3))
+                removed = [object_id for object_id in sorted(scores)[:2] if object_id not in batch]
+                for object_id in removed:
+                    del scores[object_id]
+                    del ranks[object_id]
+                scores.update(batch)
+                ranks.update(index.upsert_many(batch.items(), removed=removed))
+            else:
+                object_id = str(rng.randint(60))
+                scores[object_id] = self.random_fields(rng)
+                ranks.update(index.upsert(object_id, scores[object_id]))
+            self.assertEqual(ranks, index.ranks())
+            if scores:
+                self.assertEqual(ranks, self.full_ranks(scores))
+
+    def test_holds(self):
+        index = rank_index.RankIndex(conf.SC1_2_RANK_METRICS)
+        index.upsert('1', {'AUPR': 0.5, 'AUROC': 0.7})
+        self.assertTrue(index.holds('1', {'AUPR': 0.5, 'AUROC': 0.7, 'team': 'x'}))
+        self.assertFalse(index.holds('1', {'AUPR': 0.5, 'AUROC': 0.8}))
+        self.assertFalse(index.holds('2', {'AUPR': 0.5, 'AUROC': 0.7}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+##-----------------------------------------------------------------------------
+##
+## regression tests of the vectorized scoring kernels against getAUROC_PR
+##
+##-----------------------------------------------------------------------------
+import unittest
+import numpy as np
+import pandas as pd
+import challenge_config as conf
+import permutation
+import scoring
+
+
+def legacy_auroc_aupr(predict, truth):
+    sub_stats = pd.DataFrame.from_dict({'predict':predict, 'truth':truth}, dtype='float64')
+    sub_stats = sub_stats.sort_values(['predict'], ascending=False)
+    return conf.getAUROC_PR(sub_stats)
+
+
+def cases():
+    """
+    (name, predict, truth) with tied and imbalanced belief scores
+    """
+    rng = np.random.RandomState(7)
+    yield 'ties', rng.randint(0, 5, 200) / 4.0, (rng.rand(200) < 0.5).astype('float64')
+    yield 'imbalanced', rng.rand(300), (rng.rand(300) < 0.03).astype('float64')
+    yield 'imbalanced ties', rng.randint(0, 10, 300) / 9.0, (rng.rand(300) < 0.05).astype('float64')
+    yield 'one block', np.ones(50), (rng.rand(50) < 0.3).astype('float64')
+    truth = (rng.rand(100) < 0.2).astype('float64')
+    yield 'perfect', truth.copy(), truth
+
+
+class AurocAuprTest(unittest.TestCase):
+
+    def test_matches_getAUROC_PR(self):
+        for name, predict, truth in cases():
+            expected = legacy_auroc_aupr(predict, truth)
+            np.testing.assert_allclose(scoring.auroc_aupr(predict, truth), expected, rtol=1e-9, err_msg=name)
+
+    def test_rowwise_curves_match_getAUROC_PR(self):
+        rows = list(cases())
+        n = min(len(row[1]) for row in rows)
+        predict = np.array([row[1][:n] for row in rows])
+        truth = np.array([row[2][:n] for row in rows])
+        order = np.argsort(-predict, axis=1, kind='mergesort')
+        predict = scoring._take(predict, order)
+        truePos = (scoring._take(truth, order) == 1).astype('float64')
+        with np.errstate(divide='ignore', invalid='ignore'):
+            auroc, aupr = scoring.curve_auc(*scoring.rowwise_curves(predict, truePos))
+        for i, row in enumerate(rows):
+            expected = legacy_auroc_aupr(predict[i], truePos[i])
+            np.testing.assert_allclose((auroc[i], aupr[i]), expected, rtol=1e-9, err_msg=row[0])
+
+
+class AucPvaluesTest(unittest.TestCase):
+
+    def legacy_pvalues(self, predict, truth, permute_times, seed, batch_size):
+        """
+        The permutation p-values counted one permutation at a time with
+        getAUROC_PR, over the same permutations as auc_pvalues
+        """
+        true_auroc, true_aupr = legacy_auroc_aupr(predict, truth)
+        counts, done = np.zeros(2), 0
+        for batch, batch_seed in permutation.seeded_batches(permute_times, len(truth), batch_size, seed):
+            order = np.argsort(-predict, kind='mergesort')
+            perm = permutation.permutation_matrix(np.random.RandomState(batch_seed), batch, len(truth))
+            for row in perm:
+                auroc, aupr = legacy_auroc_aupr(predict[order], truth[order][row])
+                counts += [auroc >= true_auroc - 1e-12, aupr >= true_aupr - 1e-12]
+                done += 1
+        return tuple(counts / (done + 1))
+
+    def test_matches_legacy_permutations(self):
+        rng = np.random.RandomState(11)
+        predict = rng.randint(0, 8, 60) / 7.0
+        truth = (rng.rand(60) < 0.15).astype('float64')
+        expected = self.legacy_pvalues(predict, truth, 40, 3, 16)
+        pvalues = permutation.auc_pvalues(predict, truth, permute_times=40, seed=3, processes=1, batch_size=16)
+        np.testing.assert_allclose(pvalues, expected)
+
+    def test_independent_of_processes(self):
+        rng = np.random.RandomState(5)
+        predict = rng.rand(80)
+        truth = (rng.rand(80) < 0.1).astype('float64')
+        self.assertEqual(permutation.auc_pvalues(predict, truth, permute_times=100, seed=1, processes=1, batch_size=10),
+                         permutation.auc_pvalues(predict, truth, permute_times=100, seed=1, processes=2, batch_size=10))
+
+
+if __name__ == '__main__':
+    unittest.main()
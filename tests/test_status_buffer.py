@@ -0,0 +1,48 @@
+##-----------------------------------------------------------------------------
+##
+## tests of the write-behind buffer of submission status updates
+##
+##-----------------------------------------------------------------------------
+import unittest
+import status_buffer
+
+
+class FakeSyn(object):
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.batches = []
+
+    def restPUT(self, uri, body):
+        if self.fail:
+            raise IOError("upload failed")
+        self.batches.append(body)
+
+
+class StatusBufferTest(unittest.TestCase):
+
+    def test_stored_then_notified(self):
+        syn, stored = FakeSyn(), []
+        with status_buffer.StatusBuffer(syn, '9610091') as buffer:
+            buffer.add({'id': '1', 'status': 'SCORED'}, on_stored=stored.append)
+            self.assertEqual(stored, [])
+        self.assertEqual(len(syn.batches), 1)
+        self.assertEqual(stored, [{'id': '1', 'status': 'SCORED'}])
+
+    def test_error_in_body_is_raised(self):
+        with self.assertRaises(KeyError):
+            with status_buffer.StatusBuffer(FakeSyn(fail=True), '9610091') as buffer:
+                buffer.add({'id': '1', 'status': 'SCORED'})
+                raise KeyError('scoring failed')
+
+    def test_error_in_body_still_flushes(self):
+        syn = FakeSyn()
+        with self.assertRaises(KeyError):
+            with status_buffer.StatusBuffer(syn, '9610091') as buffer:
+                buffer.add({'id': '1', 'status': 'SCORED'})
+                raise KeyError('scoring failed')
+        self.assertEqual(len(syn.batches), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
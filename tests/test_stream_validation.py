@@ -0,0 +1,59 @@
+##-----------------------------------------------------------------------------
+##
+## tests of the single pass validation of submission files
+##
+##-----------------------------------------------------------------------------
+import os
+import shutil
+import tempfile
+import unittest
+import gold_store
+import stream_validation
+
+
+class ValidateStreamTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.goldstandard = gold_store.GoldStandard(self.write('gold.csv', 'SUBJECTID,gold\nA,1\nB,0\nC,1\n'))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, text):
+        path = os.path.join(self.dir, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def validate(self, text, chunksize=2):
+        path = self.write('submission.csv', text)
+        return stream_validation.validate_stream(path, self.goldstandard, 'predict', 'SC1', chunksize=chunksize)
+
+    def test_valid(self):
+        problems, predict = self.validate('SUBJECTID,predict\nC,0.5\nA,0.1\nB,0.7\n')
+        self.assertEqual(problems, [])
+        self.assertEqual(list(predict), [0.1, 0.7, 0.5])
+
+    def test_header_only_with_wrong_columns(self):
+        problems, predict = self.validate('SUBJECTID,score\n')
+        self.assertEqual(len(problems), 1)
+        self.assertTrue(problems[0].startswith('predict must be one of the column headers'))
+        self.assertIsNone(predict)
+
+    def test_header_only(self):
+        problems, predict = self.validate('SUBJECTID,predict\n')
+        self.assertEqual(len(problems), 1)
+        self.assertTrue(problems[0].startswith('You have missing SUBJECTIDs'))
+
+    def test_byte_order_mark(self):
+        problems, predict = self.validate(stream_validation.BOM_SUBJECTID + ',predict\nA,1\nB,2\nC,3\n')
+        self.assertEqual(problems, [])
+
+    def test_every_problem(self):
+        problems, predict = self.validate('SUBJECTID,predict\nA,x\nA,0.1\nD,0.2\n')
+        self.assertEqual(len(problems), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+##-----------------------------------------------------------------------------
+##
+## process pool for validating and scoring independent submissions
+##
+##-----------------------------------------------------------------------------
+import multiprocessing
+import pickle
+import sys
+import traceback
+
+
+def describe(exc_info):
+    """
+    :returns: (exception, traceback text) for an exc_info triple, in a form
+              that can be sent back from a worker process
+    """
+    ex = exc_info[1]
+    try:
+        pickle.loads(pickle.dumps(ex))
+    except Exception:
+        ex = Exception('%s: %s' % (type(ex).__name__, ex))
+    return (ex, ''.join(traceback.format_exception(*exc_info)))
+
+
+def call(func, *args):
+    """
+    :returns: (func(*args), None), or (None, (exception, traceback text))
+              if it raised
+    """
+    try:
+        return (func(*args), None)
+    except Exception:
+        return (None, describe(sys.exc_info()))
+
+
+def _call(task):
+    index, caller, func, args = task
+    return (index,) + caller(func, *args)
+
+
+def imap(func, argument_lists, processes, initializer=None, caller=call):
+    """
+    Runs func(*args) for each args in argument_lists on a pool of processes.
+    Workers only compute: everything that talks to Synapse stays with the
+    caller, which handles each outcome as it arrives.
+
+    :param func: module level function, so workers can unpickle it
+    :param initializer: called once in each worker before any call
+    :param caller: picklable caller(func, *args) that returns (result,
+                   error) like call, for example a sandbox.Sandbox
+
+    :returns: generator of (index, result, error) in the order the calls
+              finish, where index is the position of args in argument_lists
+              and error is None or (exception, traceback text)
+    """
+    pool = multiprocessing.Pool(processes, initializer=initializer)
+    try:
+        tasks = ((index, caller, func, args) for index, args in enumerate(argument_lists))
+        for outcome in pool.imap_unordered(_call, tasks):
+            yield outcome
+    finally:
+        pool.terminate()
+        pool.join()